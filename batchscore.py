@@ -0,0 +1,134 @@
+import detection
+
+# Offline scoring of recorded keystroke traces for tuning `limit` and `size`. Gives the same per-event verdicts
+# as KeystrokeMonitoring's threshold detector (the keyboard never blocked), computed a whole trace at a time.
+# NumPy is only needed here, never by the monitor, so it is imported on first use.
+
+def load_numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise RuntimeError("batch scoring needs NumPy: pip install numpy")
+    return numpy
+
+def delays_from_times(times):
+    np = load_numpy()
+    times = np.asarray(times, dtype=np.int64)  # pyHook times are integer milliseconds; integer sums keep the mean exact
+    return np.diff(times)
+
+def keyword_flags(keys, keywords):
+    # Content verdict per event. Matching is one scalar pass with the monitor's own automaton, shared by every
+    # limit/size combination; the flag stays set once a keyword is seen, as contentIntrusion does.
+    np = load_numpy()
+    matcher = detection.KeywordMatcher(keywords)
+    hits = np.zeros(len(keys), dtype=bool)
+    for i, key in enumerate(keys):
+        if matcher.feed(matcher.key_tokens.token(key)) is not None:
+            hits[i] = True
+            matcher.reset()
+    return np.logical_or.accumulate(hits) if len(hits) else hits
+
+def speed_matrix(delays, limits, size, mode='mean'):
+    # Rolling speed after each delay for every limit, shape (len(limits), len(delays)). The window starts out
+    # filled with limit + 1 like SpeedHistory, so only the first size - 1 columns differ between limits.
+    np = load_numpy()
+    if mode not in detection.SpeedHistory.MODES:
+        mode = 'mean'
+    limits = np.asarray(limits, dtype=np.int64)
+    fills = limits + 1
+    count = len(delays)
+    if mode == 'mean':
+        sums = np.concatenate(([0], np.cumsum(delays)))
+        index = np.arange(count)
+        start = np.maximum(index - size + 1, 0)
+        real = sums[index + 1] - sums[start]
+        padding = np.maximum(size - index - 1, 0)
+        return (real + padding * fills[:, None]) / float(size)
+    if mode == 'median':
+        speeds = np.empty((len(limits), count))
+        warm = min(size - 1, count)
+        if count >= size:
+            windows = np.lib.stride_tricks.sliding_window_view(delays, size)
+            speeds[:, size - 1:] = np.median(windows, axis=1)
+        for row, fill in enumerate(fills):
+            padded = np.concatenate((np.full(size - 1, fill), delays[:warm]))
+            if warm:
+                windows = np.lib.stride_tricks.sliding_window_view(padded, size)[:warm]
+                speeds[row, :warm] = np.median(windows, axis=1)
+        return speeds
+    # The EWMA is a recurrence; a scalar loop is the only way to stay bit-identical to SpeedHistory
+    alpha = 2.0 / (size + 1)
+    speeds = np.empty((len(limits), count))
+    values = delays.tolist()
+    for row, fill in enumerate(fills.tolist()):
+        ewma = float(fill)
+        out = speeds[row]
+        for i, delay in enumerate(values):
+            ewma += alpha * (delay - ewma)
+            out[i] = ewma
+    return speeds
+
+def score(times, keys, keywords, limit, size, mode='mean'):
+    # Per-event arrays for one configuration; the first event has no delay, so no speed and no speed verdict
+    np = load_numpy()
+    delays = delays_from_times(times)
+    speed = np.full(len(keys), np.nan)
+    speed[1:] = speed_matrix(delays, [limit], size, mode)[0]
+    speed_flags = np.zeros(len(keys), dtype=bool)
+    speed_flags[1:] = speed[1:] < limit
+    content_flags = keyword_flags(keys, keywords)
+    return {'speed': speed, 'speed_intrusion': speed_flags, 'content_intrusion': content_flags,
+            'verdict': speed_flags | content_flags}
+
+def sweep(times, keys, keywords, limits, sizes, mode='mean'):
+    # Every limit/size combination over one trace. Returns arrays of shape (len(sizes), len(limits)): the index of
+    # the first flagged event (-1 if none) and how many events were flagged.
+    np = load_numpy()
+    delays = delays_from_times(times)
+    content_flags = keyword_flags(keys, keywords)
+    limits = np.asarray(limits, dtype=np.int64)
+    first = np.full((len(sizes), len(limits)), -1, dtype=np.int64)
+    flagged = np.zeros((len(sizes), len(limits)), dtype=np.int64)
+    for row, size in enumerate(sizes):
+        verdicts = np.zeros((len(limits), len(keys)), dtype=bool)
+        verdicts[:, 1:] = speed_matrix(delays, limits, size, mode) < limits[:, None]
+        verdicts |= content_flags
+        flagged[row] = verdicts.sum(axis=1)
+        hit = verdicts.any(axis=1)
+        first[row, hit] = verdicts[hit].argmax(axis=1)
+    return {'limits': limits, 'sizes': np.asarray(sizes), 'first': first, 'flagged': flagged}
+
+def dynamics_scores(events, limit, size):
+    # Per key press DynamicsDetector score over (key, time[, down]) events, NaN until the detector gives a verdict.
+    # The features are running sums like the EWMA, so they stream; only the threshold comparison is vectorised.
+    np = load_numpy()
+    detector = detection.DynamicsDetector(limit, size)
+    warm = min(detector.MIN_KEYS, detector.size)
+    scores = []
+    prev = -1
+    for entry in events:
+        key, time = entry[0], entry[1]
+        if len(entry) > 2 and not entry[2]:
+            detector.key_up(key, time)
+            continue
+        detector.key_down(key, time)
+        score = np.nan
+        if prev != -1:
+            detector.add(key, time - prev)
+            if len(detector.features) >= warm:
+                score = detector.score
+        scores.append(score)
+        prev = time
+    return np.asarray(scores)
+
+def threshold_sweep(scores, thresholds):
+    # Every detector threshold over one trace's scores: index of the first flagged key press (-1 if none) and how
+    # many were flagged, one entry per threshold
+    np = load_numpy()
+    thresholds = np.asarray(thresholds, dtype=float)
+    with np.errstate(invalid='ignore'):
+        verdicts = scores[None, :] >= thresholds[:, None]  # NaN compares False, like the detector's warm-up
+    hit = verdicts.any(axis=1)
+    first = np.full(len(thresholds), -1, dtype=np.int64)
+    first[hit] = verdicts[hit].argmax(axis=1)
+    return {'thresholds': thresholds, 'first': first, 'flagged': verdicts.sum(axis=1)}
@@ -0,0 +1,996 @@
+# Keystroke detection engine. This is all the monitor worker process needs, so it only imports the standard
+# library at module level; the hook, GUI and notification libraries are imported where they are used.
+import os
+import sys
+import json
+import multiprocessing
+import collections
+import concurrent.futures
+import bisect
+import math
+import logging
+import logging.handlers
+import queue
+import re
+import threading
+
+BUNDLE_DIR = getattr(sys, '_MEIPASS', os.path.abspath(os.path.dirname(__file__)))
+WARNING_ICON = os.path.abspath(os.path.join(BUNDLE_DIR, r"safeusb-data\warning.png"))
+
+CWD = os.path.abspath(os.path.dirname(sys.executable))
+KEYWORDS = os.path.join(CWD, "keywords.txt")
+
+log = logging.getLogger("safeusb")
+log.propagate = False
+log.setLevel(logging.CRITICAL + 1)  # Diagnostics are off unless enabled in config.ini
+
+def setup_diagnostics(level_name):
+    # Records are only queued by the caller; a listener thread does the actual (possibly blocking) console write
+    level = logging.getLevelName(level_name.upper())
+    if not isinstance(level, int) or sys.stdout is None:
+        return None
+    diagnostics_queue = queue.SimpleQueue()
+    log.handlers = [logging.handlers.QueueHandler(diagnostics_queue)]
+    log.setLevel(level)
+    listener = logging.handlers.QueueListener(diagnostics_queue, logging.StreamHandler(sys.stdout))
+    listener.start()
+    return listener
+
+class IntrusionState:
+    # Intrusion status shared between the monitor worker and the GUI process. Every slot has exactly one writer and
+    # only ever grows (or is a flag), so writers never lock and readers just read; an aligned 64-bit slot is read whole.
+    BLOCKS = 0  # Written by the hook thread
+    UNBLOCKS = 1  # Written by the control thread, set to the BLOCKS value it has released
+    SPEED_DETECTIONS = 2  # Hook thread
+    CONTENT_DETECTIONS = 3  # Hook thread
+    LAST_DETECTION_TIME = 4  # Hook thread, event time of the last detection
+    ARMED = 5  # Control thread
+    ALERTS_SHOWN = 6  # Response worker thread
+    SIZE = 7
+
+    def __init__(self):
+        self.values = multiprocessing.RawArray('q', self.SIZE)  # Must be created before the worker is spawned
+
+    @property
+    def blocked(self):
+        return self.values[self.BLOCKS] > self.values[self.UNBLOCKS]
+
+    def record_block(self, speed, content, time):
+        values = self.values
+        values[self.SPEED_DETECTIONS] += bool(speed)
+        values[self.CONTENT_DETECTIONS] += bool(content)
+        values[self.LAST_DETECTION_TIME] = time
+        values[self.BLOCKS] += 1  # Last, so a reader that sees the block also sees its details
+
+    def record_unblock(self):
+        self.values[self.UNBLOCKS] = self.values[self.BLOCKS]
+
+    def set_armed(self, armed):
+        self.values[self.ARMED] = int(armed)
+
+    def record_alert(self):
+        self.values[self.ALERTS_SHOWN] += 1
+
+    def snapshot(self):
+        values = list(self.values)
+        return {
+            'blocked': values[self.BLOCKS] > values[self.UNBLOCKS],
+            'armed': bool(values[self.ARMED]),
+            'detections': values[self.BLOCKS],
+            'speed_detections': values[self.SPEED_DETECTIONS],
+            'content_detections': values[self.CONTENT_DETECTIONS],
+            'last_detection_time': values[self.LAST_DETECTION_TIME],
+            'alerts_shown': values[self.ALERTS_SHOWN],
+        }
+
+class IntrusionHandler:
+    def __init__(self, queue):
+        self.queue = queue
+        self.notification_sent = False  # Only meaningful on the monitor's hook thread; other processes read self.state
+        self.blocked = False  # Read by the monitor's hook on every key; other processes read self.state
+        self.state = IntrusionState()
+        self.executor = None  # Created on first use in the process that responds, executors cannot be pickled
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['executor'] = None
+        return state
+
+    def respond(self, speed=False, content=False, time=0):
+        # Called from the keyboard hook: only the block happens inline. Event logging and the (modal) warning run on
+        # a worker thread so the hook returns at once and Windows does not drop it for stalling the message pump.
+        self.state.record_block(speed, content, time)  # Before the message, which tells the GUI to read this state
+        self.block_keyboard()
+        self.start_response_executor()
+        for action in (self.write_to_event_log, self.send_intrusion_warning):
+            self.executor.submit(action).add_done_callback(lambda future, name=action.__name__: self.report_done(name, future))
+
+    def start_response_executor(self):
+        if self.executor is None:
+            self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="IntrusionResponse")
+            self.executor.submit(lambda: None)  # Start the worker thread now rather than on the first intrusion
+
+    def report_done(self, name, future):
+        error = future.exception()
+        if error is not None:
+            log.error("Intrusion response %s failed: %s", name, error)
+        elif name == 'send_intrusion_warning':
+            self.state.record_alert()
+        self.queue.put(('intrusion_response_done', name, None if error is None else str(error)))
+
+    def send_intrusion_warning(self):
+        import tkinter.messagebox as messagebox
+        from win11toast import notify
+        messagebox.showwarning("Intrusion Detected by SafeUSB", "Possible HID keystroke injection by BadUSB detected.\n\nAll keyboard input will be blocked.\n\nTo unblock, register any unregistered device (if you believe this warning is a false positive) or immediately check your physical USB port and disconnect any malicious device")
+        notify('Intrusion Detected', 'HID keystroke injection by BadUSB detected', icon=WARNING_ICON)
+
+    def write_to_event_log(self):
+        import win32evtlog
+        import win32evtlogutil
+        # Define the event source detailspowershell
+        source = 'SafeUSB'
+        event_id = 1337  # The security ID structure is invalid.
+        descr = ["HID keystroke injection by BadUSB detected"]
+        # Write to the event log
+        win32evtlogutil.ReportEvent(source, event_id, eventType=win32evtlog.EVENTLOG_WARNING_TYPE, strings=descr, data=None)
+    
+    def block_keyboard(self):
+        # The monitor's own hook suppresses key presses while this is set, see KeystrokeMonitoring.KeyboardEvent
+        self.blocked = True
+        self.queue.put(('keyboard_blocked',)) 
+    
+    def unblock_keyboard(self):
+        self.blocked = False
+        self.state.record_unblock()
+        self.queue.put(('keyboard_unblocked',)) 
+
+# Characters of a keyword, mapped to the pyHook key that types them (shifted characters to their base key)
+UNSHIFTED_KEYS = {
+    " ": "Space", "-": "Oem_Minus", "=": "Oem_Plus", ",": "Oem_Comma", ".": "Oem_Period",
+    "/": "Oem_2", ";": "Oem_1", "'": "Oem_7", "[": "Oem_4", "\\": "Oem_5", "]": "Oem_6",
+    "`": "Oem_3", "\t": "Tab", "\n": "Return",
+}
+SHIFTED_KEYS = {
+    "_": "Oem_Minus", "+": "Oem_Plus", "<": "Oem_Comma", ">": "Oem_Period", "?": "Oem_2",
+    ":": "Oem_1", '"': "Oem_7", "{": "Oem_4", "|": "Oem_5", "}": "Oem_6", "~": "Oem_3",
+    "!": "1", "@": "2", "#": "3", "$": "4", "%": "5", "^": "6", "&": "7", "*": "8", "(": "9", ")": "0",
+}
+# Names usable in chords such as "Ctrl+Alt+Del", besides pyHook's own key names
+KEY_ALIASES = {
+    "CTRL": "Lcontrol", "CONTROL": "Lcontrol", "ALT": "Lmenu", "WIN": "Lwin", "WINDOWS": "Lwin", "GUI": "Lwin",
+    "SHIFT": "Lshift", "DEL": "Delete", "ESC": "Escape", "ENTER": "Return", "BACKSPACE": "Back",
+}
+KEY_NAMES = frozenset(UNSHIFTED_KEYS.values()) | frozenset((
+    "Lwin", "Rwin", "Lcontrol", "Rcontrol", "Lmenu", "Rmenu", "Lshift", "Rshift", "Capital", "Delete", "Back",
+    "Escape", "Insert", "Home", "End", "Prior", "Next", "Up", "Down", "Left", "Right", "Apps", "Snapshot", "Pause",
+))
+KEY_NAMES_BY_UPPER = {name.upper(): name for name in KEY_NAMES}
+KEY_NAME_PATTERN = re.compile("|".join(sorted(KEY_NAMES, key=len, reverse=True)) + "|.", re.DOTALL)
+# Left and right modifiers are one token; Shift and Caps Lock only change case, so they are not tokens at all
+MODIFIER_KEYS = {
+    "Lcontrol": "Control", "Rcontrol": "Control", "Lmenu": "Menu", "Rmenu": "Menu", "Lwin": "Win", "Rwin": "Win",
+    "Lshift": "Shift", "Rshift": "Shift",
+}
+NORMALIZED_KEYS = dict(MODIFIER_KEYS, Lshift=None, Rshift=None, Capital=None)
+
+def char_key(char):
+    if char.isalpha() and char.isascii():
+        return char.upper()
+    return UNSHIFTED_KEYS.get(char) or SHIFTED_KEYS.get(char) or char
+
+def chord_key(part):
+    if len(part) == 1:
+        return char_key(part)
+    return KEY_ALIASES.get(part.upper()) or KEY_NAMES_BY_UPPER.get(part.upper()) or (
+        part.upper() if re.fullmatch(r'F([1-9]|1[0-9]|2[0-4])', part.upper()) else None)
+
+def chord_keys(chord):
+    # Keys of a chord such as "Ctrl+Alt+Shift+U", either side of a modifier counting as that modifier
+    keys = [chord_key(part.strip()) for part in chord.split("+")] if chord.strip() else []
+    if not all(keys):
+        log.warning("Ignoring unknown key in chord %r", chord)
+        return frozenset()
+    return frozenset(MODIFIER_KEYS.get(key, key) for key in keys)
+
+def keyword_keys(keyword):
+    # The pyHook keys that type a keyword. Accepts chords ("Ctrl+Alt+Del"), text ("New-Object", typed
+    # character by character) and the old concatenated key names ("NEWOem_MinusOBJECT", "LwinR").
+    # Only a modifier or named key makes a chord: "1+1" is text, typed with Oem_Plus.
+    parts = [part.strip() for part in keyword.split("+")]
+    if len(parts) > 1 and all(parts) and any(len(part) > 1 for part in parts):
+        keys = [chord_key(part) for part in parts]
+        if all(keys):
+            if any(NORMALIZED_KEYS.get(key, key) is None for key in keys):
+                # Shift is not in the key stream, so "Shift+F10" would match every F10 and "Ctrl+Shift+Esc" Ctrl+Esc
+                log.warning("Ignoring keyword %r: chords with Shift or Caps Lock cannot be told apart", keyword)
+                return []
+            return keys
+    names = KEY_NAME_PATTERN.findall(keyword)
+    if any(len(name) > 1 for name in names) and not any(name.islower() for name in names):
+        return names
+    return [char_key(char) for char in keyword]
+
+class KeyTokens:
+    # Interned key tokens: each normalized key name becomes a small int the first time it is seen, so matching
+    # and the keystroke log work on ints instead of pyHook's mixed-case names
+    def __init__(self):
+        self.ids = {}  # Normalized key name -> token
+        self.tokens = {}  # pyHook key name -> token, or None for keys that are not part of the stream
+
+    def token(self, key):
+        token = self.tokens.get(key, -1)
+        if token == -1:
+            name = NORMALIZED_KEYS.get(key, key)
+            token = None if name is None else self.ids.setdefault(name, len(self.ids))
+            self.tokens[key] = token
+        return token
+
+    def compile(self, keyword):
+        return tuple(token for token in map(self.token, keyword_keys(keyword)) if token is not None)
+
+class KeywordMatcher:
+    # Aho-Corasick automaton over key tokens, advanced one keystroke at a time. Each matcher has its own token
+    # table, so one built on the control thread never shares mutable state with the hook thread.
+    def __init__(self, keywords):
+        self.key_tokens = KeyTokens()
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [None]
+        for word in keywords:
+            self.add_keyword(word)
+        self.build_failure_links()
+        self.state = 0
+
+    def add_keyword(self, word):
+        tokens = self.key_tokens.compile(word)
+        state = 0
+        for token in tokens:
+            next_state = self.goto[state].get(token)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append(None)
+                self.goto[state][token] = next_state
+            state = next_state
+        if tokens and self.output[state] is None:
+            self.output[state] = word
+
+    def build_failure_links(self):
+        queue = collections.deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(char, 0)
+                # Inherit the match of the longest proper suffix so a hit is reported without walking the chain
+                if self.output[next_state] is None:
+                    self.output[next_state] = self.output[self.fail[next_state]]
+
+    def feed(self, token):
+        self.state, match = self.step(self.state, token)
+        return match
+
+    def step(self, state, token):
+        # Advances from an outside state, so several keyboards can share one automaton
+        if token is None:
+            return state, None
+        goto, fail = self.goto, self.fail
+        while state and token not in goto[state]:
+            state = fail[state]
+        state = goto[state].get(token, 0)
+        return state, self.output[state]
+
+    def reset(self):
+        self.state = 0
+
+class SpeedHistory:
+    # Circular window of inter-key delays with the statistic updated incrementally per keystroke
+    MODES = ('mean', 'ewma', 'median')
+
+    def __init__(self, limit, size, mode='mean'):
+        if mode not in self.MODES:
+            mode = 'mean'
+        self.mode = mode
+        self.fill = limit + 1
+        self.delays = [self.fill] * size
+        self.i = 0
+        self.total = sum(self.delays)
+        self.ordered = list(self.delays)  # Sorted copy of the window, only maintained for median mode
+        self.alpha = 2.0 / (size + 1)  # Same centre of mass as a mean over `size` delays
+        self.ewma = float(self.fill)
+
+    def __len__(self):
+        return len(self.delays)
+
+    def add(self, delay):
+        if self.i >= len(self.delays): self.i = 0
+        oldest = self.delays[self.i]
+        self.delays[self.i] = delay
+        self.i = self.i + 1
+        self.total += delay - oldest
+
+        if self.mode == 'ewma':
+            self.ewma += self.alpha * (delay - self.ewma)
+            return self.ewma
+        if self.mode == 'median':
+            del self.ordered[bisect.bisect_left(self.ordered, oldest)]
+            bisect.insort(self.ordered, delay)
+            middle = len(self.ordered) // 2
+            if len(self.ordered) % 2:
+                return float(self.ordered[middle])
+            return (self.ordered[middle - 1] + self.ordered[middle]) / 2.0
+        return self.total / float(len(self.delays))
+
+    def resize(self, size):
+        # Keeps the most recent delays, oldest first, so the next add() overwrites the oldest one
+        recent = self.delays[self.i:] + self.delays[:self.i]
+        recent = ([self.fill] * size + recent)[-size:]
+        self.delays = recent
+        self.i = 0
+        self.total = sum(recent)
+        self.ordered = sorted(recent)
+        self.alpha = 2.0 / (size + 1)
+
+class DelaySketch:
+    # Bounded-memory quantile sketch: counts per log-spaced bucket, each bucket `accuracy` wide relative to its value
+    def __init__(self, accuracy=0.02):
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets = collections.Counter()
+        self.count = 0
+
+    def add(self, value):
+        index = math.ceil(math.log(value) / self.log_gamma) if value > 1 else 0
+        self.buckets[index] += 1
+        self.count += 1
+
+    def quantile(self, fraction):
+        # Lower edge of the bucket holding the quantile, so at most about `fraction` of the values fall below it
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for index, count in sorted(self.buckets.items()):
+            seen += count
+            if seen > rank:
+                return self.gamma ** (index - 1) if index else 0.0
+        return self.gamma ** max(self.buckets)
+
+class TypingProfile:
+    # Calibration data from the user's own typing: the distribution of the speed statistic for each candidate
+    # window size, from which propose() picks the largest limit that keeps false blocks under a target rate.
+    SIZES = (5, 10, 15, 20, 30)
+    PAUSE_MS = 2000  # Longer gaps are breaks in typing, not typing speed; leaving them out keeps the proposal cautious
+    MIN_SAMPLES = 500
+
+    def __init__(self, mode='mean'):
+        self.mode = mode
+        self.prev = -1
+        self.keys = 0
+        self.histories = {size: SpeedHistory(0, size, mode) for size in self.SIZES}
+        self.sketches = {size: DelaySketch() for size in self.SIZES}
+
+    def add(self, time):
+        prev, self.prev = self.prev, time
+        if prev == -1 or not 0 <= time - prev <= self.PAUSE_MS:
+            return
+        self.keys += 1
+        for size, history in self.histories.items():
+            speed = history.add(time - prev)
+            if self.keys >= size:  # Only full windows of real delays count
+                self.sketches[size].add(speed)
+
+    def propose(self, target_rate=0.001):
+        limits = {}
+        for size, sketch in self.sketches.items():
+            if sketch.count >= self.MIN_SAMPLES:
+                limits[size] = max(int(sketch.quantile(target_rate)), 1)
+        if not limits:
+            return None
+        # Smaller windows detect sooner; take the smallest one whose limit is within 10% of the best
+        best = max(limits.values())
+        size = min(size for size, limit in limits.items() if limit >= 0.9 * best)
+        return {'limit': limits[size], 'size': size, 'mode': self.mode, 'keys': self.keys,
+                'target_rate': target_rate, 'limits': limits}
+
+class KeystrokeFeatures:
+    # Streaming keystroke-dynamics features over the last `size` key presses, each updated in O(1) per key
+    CORRECTION_KEYS = frozenset(('Back', 'Delete'))
+
+    def __init__(self, size):
+        self.size = max(size, 2)
+        self.delays = collections.deque()
+        self.delay_sum = 0
+        self.delay_squares = 0
+        self.bins = collections.deque()  # Half-octave bucket of each delay in the window
+        self.bin_counts = collections.Counter()
+        self.bin_entropy_sum = 0.0  # Sum of c * log2(c) over the bucket counts, so entropy is O(1) to read
+        self.keys = collections.deque()
+        self.corrections = 0
+        self.down_times = {}
+        self.dwells = collections.deque()
+        self.dwell_sum = 0
+
+    def add(self, key, delay):
+        delay = max(delay, 0)
+        self.delays.append(delay)
+        self.delay_sum += delay
+        self.delay_squares += delay * delay
+        self.add_bin(int(2 * math.log2(delay + 1)))
+        self.keys.append(key in self.CORRECTION_KEYS)
+        self.corrections += self.keys[-1]
+        if len(self.delays) > self.size:
+            oldest = self.delays.popleft()
+            self.delay_sum -= oldest
+            self.delay_squares -= oldest * oldest
+            self.remove_bin(self.bins.popleft())
+            self.corrections -= self.keys.popleft()
+
+    def add_bin(self, bucket):
+        count = self.bin_counts[bucket]
+        self.bin_entropy_sum += self.entropy_term(count + 1) - self.entropy_term(count)
+        self.bin_counts[bucket] = count + 1
+        self.bins.append(bucket)
+
+    def remove_bin(self, bucket):
+        count = self.bin_counts[bucket]
+        self.bin_entropy_sum += self.entropy_term(count - 1) - self.entropy_term(count)
+        self.bin_counts[bucket] = count - 1
+
+    @staticmethod
+    def entropy_term(count):
+        return count * math.log2(count) if count > 1 else 0.0
+
+    def key_down(self, key, time):
+        self.down_times[key] = time
+
+    def key_up(self, key, time):
+        down = self.down_times.pop(key, None)
+        if down is None:
+            return
+        self.dwells.append(time - down)
+        self.dwell_sum += time - down
+        if len(self.dwells) > self.size:
+            self.dwell_sum -= self.dwells.popleft()
+
+    def __len__(self):
+        return len(self.delays)
+
+    @property
+    def mean(self):
+        return self.delay_sum / len(self.delays) if self.delays else 0.0
+
+    @property
+    def variation(self):
+        # Coefficient of variation of the delays; scripted jitter is far more regular than people are
+        mean = self.mean
+        if mean <= 0:
+            return 0.0
+        variance = max(self.delay_squares / len(self.delays) - mean * mean, 0.0)
+        return math.sqrt(variance) / mean
+
+    @property
+    def entropy(self):
+        # Entropy of the delay buckets, normalised to [0, 1] by the most the window could hold
+        count = len(self.delays)
+        if count < 2:
+            return 1.0
+        entropy = math.log2(count) - self.bin_entropy_sum / count
+        return entropy / math.log2(count)
+
+    @property
+    def dwell(self):
+        return self.dwell_sum / len(self.dwells) if self.dwells else None
+
+class ScoringEngine:
+    # Weighted sum of per-feature suspicion signals in [0, 1]; features without data are left out of the sum.
+    # Each signal ramps from 0 at a typical human value to 1 at what paygen.py's randint(50, 100) payload produces.
+    # The human side comes from the typing traces in tests/test_scoring.py: 120-180 ms median delays, lognormal
+    # spread, 60-130 ms key holds and about 3% corrections.
+    WEIGHTS = {'speed': 0.35, 'regularity': 0.25, 'entropy': 0.15, 'corrections': 0.10, 'dwell': 0.15}
+    # From replay.py --sweep-thresholds over 20 seeds of each trace. A perfectly regular payload typed at human
+    # speed scores 0.588, so 0.6 missed paygen.py run with a 75 ms per-character delay; 0.58 flags it by the 12th
+    # key and still never flags the 120-180 ms typists. Fast (90 ms) typists: 3 of 20 at 0.58, 9 of 20 at 0.55.
+    THRESHOLD = 0.58
+    SPEED_RAMP = 4  # Mean delay: suspicious at `limit`, human from 4 x `limit`
+    REGULARITY_RAMP = (0.45, 0.2)  # Coefficient of variation: lognormal human typing ~0.45, uniform 50-100 ms jitter 0.19
+    ENTROPY_RAMP = (0.5, 0.2)  # Normalised delay-bucket entropy: a narrow jitter band fills only a couple of buckets
+    DWELL_RAMP_MS = (30, 5)  # Mean key hold: people hold keys 60 ms and up, injected keys are released within a few ms
+
+    def __init__(self, limit, threshold=THRESHOLD, weights=None):
+        self.limit = limit
+        self.threshold = threshold
+        self.weights = dict(weights or self.WEIGHTS)
+
+    @staticmethod
+    def ramp(value, high, low):
+        # 1 at or below `low`, 0 at or above `high`
+        return min(max((high - value) / float(high - low), 0.0), 1.0)
+
+    def signals(self, features):
+        signals = {
+            'speed': self.ramp(features.mean, self.SPEED_RAMP * self.limit, self.limit),
+            'regularity': self.ramp(features.variation, *self.REGULARITY_RAMP),
+            'entropy': self.ramp(features.entropy, *self.ENTROPY_RAMP),
+            'corrections': 0.0 if features.corrections else 1.0,
+        }
+        dwell = features.dwell
+        if dwell is not None:
+            signals['dwell'] = self.ramp(dwell, *self.DWELL_RAMP_MS)
+        return signals
+
+    def score(self, features):
+        signals = self.signals(features)
+        weight = sum(self.weights[name] for name in signals)
+        return sum(self.weights[name] * value for name, value in signals.items()) / weight
+
+class DynamicsDetector:
+    # Pluggable alternative to the plain speed threshold. Detectors take add(key, delay) -> verdict,
+    # key_down / key_up(key, time) for dwell times, and reset().
+    name = 'dynamics'
+    MIN_KEYS = 5  # No verdict until the window has enough keys to say anything
+
+    def __init__(self, limit, size):
+        self.limit = limit
+        self.size = size
+        self.features = KeystrokeFeatures(size)
+        self.engine = ScoringEngine(limit)
+        self.score = 0.0
+
+    def add(self, key, delay):
+        self.features.add(key, delay)
+        if len(self.features) < min(self.MIN_KEYS, self.size):
+            return False
+        self.score = self.engine.score(self.features)
+        return self.score >= self.engine.threshold
+
+    def key_down(self, key, time):
+        self.features.key_down(key, time)
+
+    def key_up(self, key, time):
+        self.features.key_up(key, time)
+
+    def reset(self):
+        self.__init__(self.limit, self.size)
+
+DETECTORS = {'threshold': None, 'dynamics': DynamicsDetector}  # 'threshold' is the built-in rule in calculate_speed
+
+def make_detector(name, limit, size):
+    detector = DETECTORS.get(name)
+    return detector(limit, size) if detector is not None else None
+
+HARDWARE_ID = re.compile(r'VID_([0-9A-Fa-f]{4})&PID_([0-9A-Fa-f]{4})')
+
+def hardware_id(device_path):
+    # "VID_xxxx&PID_xxxx" from a USB instance id or a Raw Input device path, the part both sides agree on
+    match = HARDWARE_ID.search(device_path or '')
+    return f"VID_{match.group(1).upper()}&PID_{match.group(2).upper()}" if match else None
+
+class RawKeyEvent:
+    __slots__ = ('Key', 'Time', 'Device', 'Up')
+
+    def __init__(self, key, time, device, up=False):
+        self.Key = key
+        self.Time = time
+        self.Device = device
+        self.Up = up
+
+class DeviceChannel:
+    # Speed, detector and keyword state of one keyboard
+    __slots__ = ('prev', 'speed', 'history', 'detector', 'state', 'speedIntrusion', 'contentIntrusion')
+
+    def __init__(self, limit, size, mode, detector_name='threshold'):
+        self.prev = -1
+        self.speed = 0
+        self.history = SpeedHistory(limit, size, mode)
+        self.detector = make_detector(detector_name, limit, size)  # Dwell times and rhythm belong to one keyboard
+        self.state = 0  # KeywordMatcher state
+        self.speedIntrusion = False
+        self.contentIntrusion = False
+
+class DeviceAttribution:
+    # Per-keyboard detection state keyed by Raw Input device handle. A keyboard is trusted, and skipped, when its
+    # hardware id belongs to a registered device and to no unregistered one: a BadUSB cloning a registered
+    # keyboard's VID/PID makes both monitored. Events without a device (injected input) are always monitored.
+    def __init__(self, limit, size, mode, detector_name='threshold'):
+        self.limit = limit
+        self.size = size
+        self.mode = mode
+        self.detector_name = detector_name
+        self.trusted_ids = frozenset()
+        self.untrusted_ids = frozenset()
+        self.source = None  # Resolves handles to device paths once the Raw Input source is running
+        self.channels = {}  # Device handle -> DeviceChannel, or None for a trusted keyboard
+        self.device_ids = {}  # Device handle -> hardware id, kept across resets so trust can be rechecked
+
+    def trusted(self, device_id):
+        return device_id is not None and device_id in self.trusted_ids and device_id not in self.untrusted_ids
+
+    def channel(self, device):
+        if device in self.channels:
+            return self.channels[device]
+        if device not in self.device_ids:
+            path = self.source.device_name(device) if device and self.source is not None else None
+            self.device_ids[device] = hardware_id(path)
+        device_id = self.device_ids[device]
+        trusted = self.trusted(device_id)
+        channel = None if trusted else DeviceChannel(self.limit, self.size, self.mode, self.detector_name)
+        self.channels[device] = channel
+        log.info("Keyboard %s (%s): %s", device, device_id, "trusted" if trusted else "monitored")
+        return channel
+
+    def set_devices(self, trusted_ids, untrusted_ids):
+        # Only keyboards whose trust changed lose their channel; the rest keep their speed and keyword state
+        self.trusted_ids = frozenset(trusted_ids)
+        self.untrusted_ids = frozenset(untrusted_ids)
+        for device, channel in list(self.channels.items()):
+            if self.trusted(self.device_ids.get(device)) != (channel is None):
+                del self.channels[device]  # Recreated with its new trust on the keyboard's next key
+
+    def configure(self, limit, size, mode):
+        self.limit = limit
+        self.size = size
+        self.mode = mode
+        self.channels.clear()
+
+    def reset(self):
+        self.channels.clear()
+
+class RawInputSource:
+    # Windows Raw Input on a message-only window: reports each key press with the handle of the keyboard that
+    # sent it. The low-level hook cannot tell keyboards apart, and WM_INPUT only arrives after the hook has run,
+    # so with attribution on the hook only enforces blocking and detection runs from here.
+    WM_INPUT = 0x00FF
+    RID_INPUT = 0x10000003
+    RIDI_DEVICENAME = 0x20000007
+    RIDEV_INPUTSINK = 0x00000100
+    RIM_TYPEKEYBOARD = 1
+    RI_KEY_BREAK = 0x01
+    RI_KEY_E0 = 0x02
+
+    def __init__(self, callback):
+        self.callback = callback
+        self.names = {}
+
+    def start(self):
+        import ctypes
+        from ctypes import wintypes
+        import win32api
+        import win32con
+        import win32gui
+        from pyWinhook import HookConstants
+
+        class RAWINPUTDEVICE(ctypes.Structure):
+            _fields_ = [('usUsagePage', wintypes.USHORT), ('usUsage', wintypes.USHORT),
+                        ('dwFlags', wintypes.DWORD), ('hwndTarget', wintypes.HWND)]
+
+        class RAWINPUTHEADER(ctypes.Structure):
+            _fields_ = [('dwType', wintypes.DWORD), ('dwSize', wintypes.DWORD),
+                        ('hDevice', wintypes.HANDLE), ('wParam', wintypes.WPARAM)]
+
+        class RAWKEYBOARD(ctypes.Structure):
+            _fields_ = [('MakeCode', wintypes.USHORT), ('Flags', wintypes.USHORT), ('Reserved', wintypes.USHORT),
+                        ('VKey', wintypes.USHORT), ('Message', wintypes.UINT), ('ExtraInformation', wintypes.ULONG)]
+
+        class RAWINPUT(ctypes.Structure):
+            _fields_ = [('header', RAWINPUTHEADER), ('keyboard', RAWKEYBOARD)]
+
+        self.ctypes = ctypes
+        self.user32 = ctypes.windll.user32
+        self.RAWINPUT = RAWINPUT
+        self.header_size = ctypes.sizeof(RAWINPUTHEADER)
+        self.key_name = HookConstants.IDToName
+
+        window_class = win32gui.WNDCLASS()
+        window_class.lpfnWndProc = {self.WM_INPUT: self.on_input}
+        window_class.lpszClassName = "SafeUSBRawInput"
+        window_class.hInstance = win32api.GetModuleHandle(None)
+        hwnd = win32gui.CreateWindow(win32gui.RegisterClass(window_class), "SafeUSB Raw Input", 0, 0, 0, 0, 0,
+                                     win32con.HWND_MESSAGE, 0, window_class.hInstance, None)
+        device = RAWINPUTDEVICE(0x01, 0x06, self.RIDEV_INPUTSINK, hwnd)  # Generic desktop keyboards, even when not focused
+        if not self.user32.RegisterRawInputDevices(ctypes.byref(device), 1, ctypes.sizeof(device)):
+            raise ctypes.WinError()
+
+    def on_input(self, hwnd, message, wparam, lparam):
+        import win32gui
+        ctypes = self.ctypes
+        raw = self.RAWINPUT()
+        size = ctypes.c_uint(ctypes.sizeof(raw))
+        if self.user32.GetRawInputData(ctypes.c_void_p(lparam), self.RID_INPUT, ctypes.byref(raw), ctypes.byref(size), self.header_size) > 0:
+            keyboard = raw.keyboard
+            if raw.header.dwType == self.RIM_TYPEKEYBOARD:
+                time = self.user32.GetMessageTime() & 0xFFFFFFFF
+                up = bool(keyboard.Flags & self.RI_KEY_BREAK)  # Key-ups only feed a detector's dwell times
+                self.callback(RawKeyEvent(self.key_name(self.side_specific(keyboard)), time, raw.header.hDevice, up))
+        return win32gui.DefWindowProc(hwnd, message, wparam, lparam)
+
+    def side_specific(self, keyboard):
+        # Raw Input reports Shift/Ctrl/Alt generically; the hook, and so the keyword list, uses left/right names
+        vkey = keyboard.VKey
+        if vkey == 0x10:
+            return self.user32.MapVirtualKeyW(keyboard.MakeCode, 3)  # MAPVK_VSC_TO_VK_EX
+        if vkey == 0x11:
+            return 0xA3 if keyboard.Flags & self.RI_KEY_E0 else 0xA2
+        if vkey == 0x12:
+            return 0xA5 if keyboard.Flags & self.RI_KEY_E0 else 0xA4
+        return vkey
+
+    def device_name(self, handle):
+        if handle not in self.names:
+            ctypes = self.ctypes
+            length = ctypes.c_uint(0)
+            self.user32.GetRawInputDeviceInfoW(ctypes.c_void_p(handle), self.RIDI_DEVICENAME, None, ctypes.byref(length))
+            buffer = ctypes.create_unicode_buffer(length.value + 1)
+            if self.user32.GetRawInputDeviceInfoW(ctypes.c_void_p(handle), self.RIDI_DEVICENAME, buffer, ctypes.byref(length)) > 0:
+                self.names[handle] = buffer.value
+            else:
+                self.names[handle] = None
+        return self.names[handle]
+
+class KeystrokeMonitoring:
+    def __init__(self, intrusion_handler, config_handler):
+        self.intrusion_handler = intrusion_handler # Create an instance of IntrusionHandler
+        self.config_handler = config_handler
+        self.limit = self.config_handler.load_int_from_config('KeystrokeMonitoring', 'limit')
+        self.size = self.config_handler.load_int_from_config('KeystrokeMonitoring', 'size')
+        self.mode = self.config_handler.load_str_from_config('KeystrokeMonitoring', 'mode', 'mean')
+        self.detector_name = self.config_handler.load_str_from_config('KeystrokeMonitoring', 'detector', 'threshold')
+        attribution = self.config_handler.load_str_from_config('KeystrokeMonitoring', 'attribution', 'global')
+        self.calibration_rate = float(self.config_handler.load_str_from_config('KeystrokeMonitoring', 'calibration_rate', '0.001'))
+        self.diagnostics_level = self.config_handler.load_str_from_config('Diagnostics', 'level', 'OFF')
+        allowlist = self.config_handler.load_str_from_config('KeystrokeMonitoring', 'block_allowlist', '')
+        self.block_allowlist = frozenset(key.strip() for key in allowlist.split(',') if key.strip())  # Keys that still work while blocked
+        # Lifts the block from the keyboard itself. Off by default: a BadUSB can press any chord it knows about.
+        self.unlock_chord = chord_keys(self.config_handler.load_str_from_config('KeystrokeMonitoring', 'unlock_chord', ''))
+        self.unlock_held = set()  # Chord keys currently held down, tracked from key-downs while blocked and all key-ups
+        self.speed = 0
+        self.prev = -1
+        self.speedIntrusion = False
+        self.history = SpeedHistory(self.limit, self.size, self.mode)
+        self.detector = make_detector(self.detector_name, self.limit, self.size)
+        # 'device' keeps detection state per keyboard and skips registered ones; 'global' treats all keys as one stream
+        self.attribution = DeviceAttribution(self.limit, self.size, self.mode, self.detector_name) if attribution == 'device' else None
+        self.keyWords = self.read_keywords()
+        self.contentIntrusion = False
+        self.pending_updates = collections.deque()  # Filled by the control thread, applied on the hook thread
+        self.armed = True
+        self.profile = None  # TypingProfile while calibrating, fed only while disarmed
+    
+    def read_keywords(self):
+        keywords = self.load_keywords()
+        self.keyword_matcher = KeywordMatcher(keywords)  # Built once, then stepped per keystroke
+        return keywords
+
+    def configure(self, limit, size, mode):
+        self.limit = limit
+        self.size = size
+        if mode != self.history.mode:
+            self.mode = mode
+            self.history = SpeedHistory(limit, size, mode)
+        elif size != len(self.history):
+            self.history.resize(size)
+        if self.detector is not None and (limit, size) != (self.detector.limit, self.detector.size):
+            self.detector = make_detector(self.detector_name, limit, size)
+        if self.attribution is not None:
+            self.attribution.configure(limit, size, self.history.mode)
+
+    def set_keywords(self, keywords, keyword_matcher=None):
+        self.keyWords = keywords
+        self.keyword_matcher = keyword_matcher or KeywordMatcher(keywords)
+        if self.attribution is not None:
+            self.attribution.reset()  # Matcher states belong to the old automaton
+
+    def reset(self):
+        # Start every monitoring session from a clean slate so keys typed while disarmed cannot count against it
+        self.speed = 0
+        self.prev = -1
+        self.speedIntrusion = False
+        self.contentIntrusion = False
+        self.history = SpeedHistory(self.limit, self.size, self.history.mode)
+        if self.detector is not None:
+            self.detector.reset()
+        if self.attribution is not None:
+            self.attribution.reset()
+        self.keyword_matcher.reset()
+
+    def receive_control(self, control_queue):
+        # Runs on its own thread in the monitor process. Anything expensive (building the automaton) happens here,
+        # the hook thread only swaps the result in before its next keystroke.
+        while True:
+            action, *data = control_queue.get()
+            if action == 'arm':
+                self.pending_updates.append((self.reset, ()))
+                self.armed = True
+                self.intrusion_handler.state.set_armed(True)
+            elif action == 'disarm':
+                self.armed = False
+                self.intrusion_handler.state.set_armed(False)
+            elif action == 'unblock':
+                self.intrusion_handler.unblock_keyboard()  # The block lives in this process, so only it can lift it
+            elif action == 'config':
+                self.pending_updates.append((self.configure, data))
+            elif action == 'keywords':
+                keywords = data[0]
+                self.pending_updates.append((self.set_keywords, (keywords, KeywordMatcher(keywords))))
+            elif action == 'calibrate':
+                self.calibrate(*data)
+            elif action == 'devices' and self.attribution is not None:
+                self.pending_updates.append((self.attribution.set_devices, data))
+
+    def calibrate(self, command, mode='mean'):
+        # Config updates wait for the next armed keystroke, so the GUI passes the mode to calibrate for
+        if command == 'start':
+            self.profile = TypingProfile(mode)
+        elif command == 'stop':
+            self.profile = None
+        elif command == 'report' and self.profile is not None:
+            proposal = self.profile.propose(self.calibration_rate)
+            if proposal is not None:
+                self.profile = None
+            self.intrusion_handler.queue.put(('calibration', proposal))
+
+    def apply_updates(self):
+        while self.pending_updates:
+            update, args = self.pending_updates.popleft()
+            update(*args)
+            log.info("Applied live update: %s", update.__name__)
+
+    def load_keywords(self):
+        filename = KEYWORDS
+        default_keywords = ["POWERSHELL", "CMD.EXE", "USER", "HOSTNAME", "TASK", "New-Object", "Win+X", "Win+R", "Ctrl+Alt+Del"]
+
+        # Check if file exists
+        if not os.path.exists(filename):
+            with open(filename, 'x+') as f:
+                json.dump(default_keywords, f)
+            return default_keywords
+
+        # Load keywords from file
+        with open(filename, 'r') as f:
+            try:
+                keywords = json.load(f)
+                # If file is empty, write the default keywords
+                if not keywords:
+                    raise ValueError("Keyword list is empty")
+            except Exception as e:
+                import tkinter.messagebox as messagebox
+                messagebox.showerror("Error", str(e))
+                with open(filename, 'w') as f:
+                    json.dump(default_keywords, f)
+                return default_keywords
+        return keywords
+
+    def KeyboardEvent(self, event):
+        # Returning False swallows the key press, which is how the keyboard is blocked: one hook, one set lookup
+        if not self.armed:
+            if self.profile is not None:
+                self.profile.add(event.Time)
+            return True
+        if self.intrusion_handler.blocked:
+            if self.unlock_chord:
+                key = MODIFIER_KEYS.get(event.Key, event.Key)
+                if key in self.unlock_chord:
+                    self.unlock_held.add(key)
+                    if self.unlock_held >= self.unlock_chord:
+                        self.panic_unlock()
+                    return False
+            return event.Key in self.block_allowlist
+        if self.attribution is not None:
+            return True  # Detection runs per keyboard in DeviceKeyEvent
+        if self.pending_updates:
+            self.apply_updates()
+        token = self.keyword_matcher.key_tokens.token(event.Key)
+        self.log_key(event.Key)
+        self.detect_keywords(token)
+        self.calculate_speed(event.Time, event.Key)
+        self.detect_intrusion()
+        return not self.intrusion_handler.blocked
+
+    def DeviceKeyEvent(self, event):
+        # Key presses tagged with their keyboard; a registered keyboard costs one dict lookup and nothing else
+        if not self.armed or self.intrusion_handler.blocked:
+            return
+        if self.pending_updates:
+            self.apply_updates()
+        channel = self.attribution.channel(event.Device)
+        if channel is None:
+            return
+        if event.Up:
+            if channel.detector is not None:
+                channel.detector.key_up(event.Key, event.Time)
+            return
+        if channel.detector is not None:
+            channel.detector.key_down(event.Key, event.Time)
+        channel.state, word = self.keyword_matcher.step(channel.state, self.keyword_matcher.key_tokens.token(event.Key))
+        if word is not None:
+            log.info("[*] Key Words Detected on %s: [%s]", event.Device, word)
+            channel.contentIntrusion = True
+            channel.state = 0
+        if channel.prev != -1:
+            delay = event.Time - channel.prev
+            channel.speed = channel.history.add(delay)
+            log.debug("Typing Speed on %s (%s): %s", event.Device, channel.history.mode, channel.speed)
+            if channel.detector is not None:
+                channel.speedIntrusion = channel.detector.add(event.Key, delay)
+                log.debug("Detector score on %s (%s): %.2f", event.Device, channel.detector.name, channel.detector.score)
+            else:
+                channel.speedIntrusion = channel.speed < self.limit
+        channel.prev = event.Time
+        self.speed, self.prev = channel.speed, event.Time
+        self.speedIntrusion, self.contentIntrusion = channel.speedIntrusion, channel.contentIntrusion
+        self.detect_intrusion()
+
+    def panic_unlock(self):
+        log.warning("Unlock chord pressed, lifting the keyboard block")
+        self.unlock_held.clear()
+        self.intrusion_handler.unblock_keyboard()
+        self.reset()  # Otherwise the window that triggered the block would block again on the next key
+
+    def KeyUpEvent(self, event):
+        # Only hooked when the detector uses dwell times or an unlock chord is set; key-ups are never suppressed
+        if self.unlock_held:
+            self.unlock_held.discard(MODIFIER_KEYS.get(event.Key, event.Key))
+        if self.armed and self.detector is not None and self.attribution is None:
+            self.detector.key_up(event.Key, event.Time)  # With attribution the Raw Input key-up goes to the channel
+        return True
+
+    def log_key(self, key):
+        log.debug("Keystroke : %s", key)
+
+    def detect_keywords(self, token):
+        word = self.keyword_matcher.feed(token)
+        if word is not None:
+            log.info("[*] Key Words Detected: [%s]", word)
+            self.contentIntrusion = True
+            self.keyword_matcher.reset()
+
+    def calculate_speed(self, time, key=None):
+        if self.detector is not None:
+            self.detector.key_down(key, time)
+        if (self.prev == -1):
+            self.prev = time
+            return
+
+        log.debug("%s - %s = %s", time, self.prev, time - self.prev)
+        self.speed = self.history.add(time - self.prev)
+        delay = time - self.prev
+        self.prev = time
+
+        log.debug("Typing Speed (%s): %s", self.history.mode, self.speed)
+
+        if self.detector is not None:
+            self.speedIntrusion = self.detector.add(key, delay)
+            log.debug("Detector score (%s): %.2f", self.detector.name, self.detector.score)
+        elif (self.speed < self.limit):
+            self.speedIntrusion = True
+        else:
+            self.speedIntrusion = False
+
+    def detect_intrusion(self):
+        if (self.speedIntrusion or self.contentIntrusion) and not self.intrusion_handler.notification_sent:
+            self.intrusion_handler.respond(self.speedIntrusion, self.contentIntrusion, self.prev)
+            self.intrusion_handler.notification_sent = True
+        elif not self.speedIntrusion and not self.contentIntrusion:
+            self.intrusion_handler.notification_sent = False
+
+    def start(self, control_queue=None):
+        setup_diagnostics(self.diagnostics_level)  # Runs in the monitor process, which does not inherit the parent's logging setup
+        if control_queue is not None:
+            self.armed = False  # Started ahead of time as a worker; the enumerator arms it when an unregistered HID appears
+            threading.Thread(target=self.receive_control, args=(control_queue,), name="KeystrokeControl", daemon=True).start()
+        import pyWinhook as pyHook
+        import pythoncom
+        self.intrusion_handler.start_response_executor()
+        keyhook = pyHook.HookManager()
+        keyhook.KeyDown = self.KeyboardEvent
+        if self.detector is not None or self.unlock_chord:
+            keyhook.KeyUp = self.KeyUpEvent
+        keyhook.HookKeyboard()
+        if self.attribution is not None:
+            self.attribution.source = RawInputSource(self.DeviceKeyEvent)
+            self.attribution.source.start()
+        pythoncom.PumpMessages()
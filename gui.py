@@ -0,0 +1,474 @@
+# SafeUSB's window: device tables, configuration tab and the bridge that feeds them queued messages.
+# Only the GUI process imports this module, so the monitor worker never loads Tk, Pillow or pystray.
+import os
+import sys
+import configparser
+import re
+import collections
+import threading
+import time
+import tkinter as tk
+import tkinter.ttk as ttk
+import tkinter.font as tkFont
+import tkinter.messagebox as messagebox
+from pystray import MenuItem as item
+import pystray
+from PIL import Image, ImageTk
+from win11toast import notify
+from detection import log, SpeedHistory
+
+BUNDLE_DIR = getattr(sys, '_MEIPASS', os.path.abspath(os.path.dirname(__file__)))
+APP_ICON = os.path.abspath(os.path.join(BUNDLE_DIR, r"safeusb-data\favicon.ico"))
+INFO_ICON = os.path.abspath(os.path.join(BUNDLE_DIR, r"safeusb-data\information.png")) 
+
+class App:
+    def __init__(self, root, usb_enumerator, intrusion_handler, keymon, config_handler, registry_manager):
+        self.root = root
+        self.usb_enumerator = usb_enumerator
+        self.intrusion_handler = intrusion_handler
+        self.keymon = keymon
+        self.config_handler = config_handler
+        self.registry_manager = registry_manager
+        self.startup_checkbox = tk.IntVar()
+        self.setup_window()
+        self.setup_tab_control()
+        self.setup_device_table()
+        self.setup_registered_device_table()
+        self.setup_status_labels()
+        self.setup_buttons()
+        self.setup_autostartcheckbox()
+        self.setup_keymonconfig()
+        self.usb_enumerator.registry.subscribe(self.on_registry_changed)
+        self.refresh_registered_device()
+
+    def setup_window(self):
+        self.root.title("SafeUSB")
+        icon = Image.open(APP_ICON)
+        icon = ImageTk.PhotoImage(icon)
+        self.root.iconphoto(True, icon)
+        width, height = 680, 290
+        screenwidth, screenheight = self.root.winfo_screenwidth(), self.root.winfo_screenheight()
+        alignstr = '%dx%d+%d+%d' % (width, height, (screenwidth - width) / 2, (screenheight - height) / 2)
+        self.root.geometry(alignstr)
+        self.root.resizable(width=False, height=False)
+
+    def setup_tab_control(self):
+        self.tabControl = ttk.Notebook(self.root)
+        self.tab1, self.tab2, self.tab3 = ttk.Frame(self.tabControl), ttk.Frame(self.tabControl), ttk.Frame(self.tabControl)
+        self.tabControl.add(self.tab1, text='Active Devices')
+        self.tabControl.add(self.tab2, text='Safe Devices')
+        self.tabControl.add(self.tab3, text='Configuration')
+        self.tabControl.pack(expand=1, fill="both")
+
+    def setup_table(self, tab, columns, scrollbar_x, scrollbar_y):
+        scrollbar = ttk.Scrollbar(tab)
+        scrollbar.place(x=scrollbar_x, y=scrollbar_y, height=207)
+        table = ttk.Treeview(tab, selectmode="extended", show="headings", yscrollcommand=scrollbar.set)
+        scrollbar.configure(command=table.yview)
+        table['columns'] = columns
+        for col in table['columns']:
+            table.heading(col, text=col)
+            table.column(col, width=tkFont.Font().measure(col))
+        table.place(x=10, y=10, width=647, height=207)
+        return table
+
+    def setup_device_table(self):
+        self.deviceTable = self.setup_table(self.tab1, ('Device Name', 'Class', 'Status', 'Device ID'), 657, 10)
+        self.deviceTable.tag_configure('Safe', background='green')
+        self.deviceTable.tag_configure('Unregistered', background='yellow')
+        self.device_rows = {}  # USBEnumerator device key -> Treeview item
+        self.device_keys = {}  # Treeview item -> USBEnumerator device key
+
+    def setup_registered_device_table(self):
+        # The safe list can hold tens of thousands of managed entries, so only the visible rows are put into Tk
+        self.registeredDeviceTable = VirtualTable(self.tab2, ('Device Name', 'Device Class', 'Device ID'), self.usb_enumerator.registry, 657, 10)
+        self.filter_label = ttk.Label(self.tab2, text="Filter")
+        self.filter_label.place(x=160, y=233)
+        self.filter_text = tk.StringVar()
+        self.filter_text.trace_add('write', lambda *args: self.registeredDeviceTable.set_filter(self.filter_text.get()))
+        self.filter_entry = ttk.Entry(self.tab2, textvariable=self.filter_text)
+        self.filter_entry.place(x=200, y=232)
+
+    def setup_status_labels(self):
+        self.keystroke_status_label = tk.Label(self.root, text="Keystroke Monitoring: Stopped", fg="green")
+        self.keystroke_status_label.place(x=320, y=253)
+
+        self.keyboard_block_status_label = tk.Label(self.root, text="Keyboard Unblocked", fg="green")
+        self.keyboard_block_status_label.place(x=520, y=253)
+
+    def setup_buttons(self):
+        self.authButton = ttk.Button(self.tab1, text="Register Device as Safe", command=self.register_selected_devices)
+        self.authButton.place(x=10, y=230)
+        self.unauthButton = ttk.Button(self.tab2, text="Unregister Device", command=self.unregister_selected_devices)
+        self.unauthButton.place(x=10, y=230)
+        
+    def setup_autostartcheckbox(self):
+        try:
+            self.startup_checkbox.set(self.config_handler.load_from_config('Autostart', 'run_at_startup'))
+        except (configparser.NoSectionError, configparser.NoOptionError):
+            self.startup_checkbox.set(self.registry_manager.check_autostart_registry("SafeUSB"))
+
+        self.chk = ttk.Checkbutton(self.tab3, text="Run at startup", variable=self.startup_checkbox, command=self.toggle_autostart)
+        self.chk.place(x=10, y=10)
+        
+    def setup_keymonconfig(self):
+        self.limit_label = ttk.Label(self.tab3, text="Keystroke speed threshold")
+        self.limit_label.place(x=10, y=50)
+        self.limit_entry = ttk.Entry(self.tab3)
+        self.limit_entry.place(x=10, y=70)
+        self.limit_entry.insert(0, self.keymon.limit)
+
+        self.size_label = ttk.Label(self.tab3, text="Keystroke size")
+        self.size_label.place(x=10, y=110)
+        self.size_entry = ttk.Entry(self.tab3)
+        self.size_entry.place(x=10, y=130)
+        self.size_entry.insert(0, self.keymon.size)
+
+        self.mode_label = ttk.Label(self.tab3, text="Keystroke speed statistic")
+        self.mode_label.place(x=10, y=170)
+        self.mode_combobox = ttk.Combobox(self.tab3, values=SpeedHistory.MODES, state="readonly")
+        self.mode_combobox.place(x=10, y=190)
+        self.mode_combobox.set(self.keymon.history.mode)
+
+        self.save_limit_button = ttk.Button(self.tab3, text="Save", command=self.save_keymonconfig)
+        self.save_limit_button.place(x=10, y=230)
+        self.reload_keywords_button = ttk.Button(self.tab3, text="Reload Keywords", command=self.reload_keywords)
+        self.reload_keywords_button.place(x=100, y=230)
+        self.calibrate_button = ttk.Button(self.tab3, text="Calibrate", command=self.toggle_calibration)
+        self.calibrate_button.place(x=215, y=230)
+        self.calibrating = False
+        
+    def save_keymonconfig(self):
+        limit = self.limit_entry.get()
+        size = self.size_entry.get()
+
+        if not self.validate_positive_integer(limit):
+            messagebox.showerror("Invalid Input", "Keystroke speed threshold must be a positive integer.")
+            self.limit_entry.delete(0, tk.END)
+            self.limit_entry.insert(0, self.keymon.limit)
+            return
+
+        if not self.validate_positive_integer(size):
+            messagebox.showerror("Invalid Input", "Keystroke size must be a positive integer.")
+            self.size_entry.delete(0, tk.END)
+            self.size_entry.insert(0, self.keymon.size)
+            return
+
+        limit = int(limit)
+        size = int(size)
+
+        if not (1 <= limit <= 1000):
+            messagebox.showerror("Invalid Input", "Keystroke speed threshold must be between 1 and 1000.")
+            self.limit_entry.delete(0, tk.END)
+            self.limit_entry.insert(0, self.keymon.limit)
+            return
+
+        if not (1 <= size <= 1000):
+            messagebox.showerror("Invalid Input", "Keystroke size must be between 1 and 1000.")
+            self.size_entry.delete(0, tk.END)
+            self.size_entry.insert(0, self.keymon.size)
+            return
+
+        mode = self.mode_combobox.get()
+
+        self.usb_enumerator.update_keystroke_monitoring(limit, size, mode)
+        self.config_handler.save_int_to_config('KeystrokeMonitoring', 'limit', limit)
+        self.config_handler.save_int_to_config('KeystrokeMonitoring', 'size', size)
+        self.config_handler.save_str_to_config('KeystrokeMonitoring', 'mode', mode)
+        messagebox.showinfo("Info", "Keystroke Monitoring configuration applied")
+
+    def reload_keywords(self):
+        self.usb_enumerator.update_keywords(self.keymon.load_keywords())
+        messagebox.showinfo("Info", "Keyword list reloaded")
+
+    def toggle_calibration(self):
+        # Calibration learns from normal typing while no unregistered HID is attached; finishing asks the
+        # monitor for a proposal, which arrives as a 'calibration' message
+        if not self.calibrating:
+            if not self.usb_enumerator.calibrate('start', self.mode_combobox.get()):
+                messagebox.showerror("Error", "Calibration could not start: the keystroke monitor is not running. Restart SafeUSB and try again.")
+                return
+            self.calibrating = True
+            self.calibrate_button.config(text="Finish Calibration")
+            messagebox.showinfo("Info", "Calibration started. Type normally for a while, then click Finish Calibration.")
+        elif not self.usb_enumerator.calibrate('report'):
+            # The typing recorded so far died with the monitor, so there is nothing left to report
+            self.calibrating = False
+            self.calibrate_button.config(text="Calibrate")
+            messagebox.showerror("Error", "Calibration was lost: the keystroke monitor stopped. Restart SafeUSB and calibrate again.")
+
+    def apply_calibration(self, proposal):
+        if proposal is None:
+            messagebox.showinfo("Info", "Not enough typing recorded yet. Keep typing normally and try again.")
+            return
+        self.calibrating = False
+        self.calibrate_button.config(text="Calibrate")
+        self.limit_entry.delete(0, tk.END)
+        self.limit_entry.insert(0, proposal['limit'])
+        self.size_entry.delete(0, tk.END)
+        self.size_entry.insert(0, proposal['size'])
+        messagebox.showinfo("Info", f"From {proposal['keys']} keystrokes: threshold {proposal['limit']}, size {proposal['size']} "
+                                    f"keeps false blocks under {proposal['target_rate']:.2%} of keystrokes. Click Save to apply.")
+
+    def validate_positive_integer(self, value):
+        return bool(re.match(r'^[1-9]\d*$', value))
+        
+    def toggle_autostart(self):
+        app_name = "SafeUSB"
+        key_data = sys.executable
+        autostart = self.startup_checkbox.get()
+
+        if autostart:
+            if not self.registry_manager.set_autostart_registry(app_name, key_data):
+                messagebox.showerror("Error", "Failed to set autostart.")
+        else:
+            if not self.registry_manager.set_autostart_registry(app_name, key_data, autostart=False):
+                messagebox.showerror("Error", "Failed to remove autostart.")
+
+        self.config_handler.save_to_config('Autostart', 'run_at_startup', str(autostart))
+
+    def register_selected_devices(self):
+        selected_items = self.deviceTable.selection()
+        if not selected_items:
+            messagebox.showwarning("Warning", "No device selected.")
+            return
+
+        # Validate first and warn only after the batch: a modal dialog must never be open while the registry lock
+        # is held, or hot-plugged devices would go unclassified (and unmonitored) until it is dismissed
+        warnings = []
+        selected = []
+        for item in selected_items:
+            device_name, device_class, device_status, device_id = self.deviceTable.item(item, "values")
+            if device_status == 'Safe':
+                warnings.append(f"Device {device_name} is already registered.")
+                continue
+
+            key = self.device_keys.get(item)
+            if key not in self.usb_enumerator.devices:
+                warnings.append(f"Device {device_name} not found.")
+                continue
+
+            if (device_name, device_class, device_id) in self.usb_enumerator.registry:
+                warnings.append(f"Device {device_name} is already registered.")
+                continue
+            selected.append((device_name, device_class, device_id))
+
+        with self.usb_enumerator.registry.batch():  # One database write for the whole selection
+            for device_name, device_class, device_id in selected:
+                self.usb_enumerator.write_to_database(device_name, device_class, device_id)
+        # The commit has the enumerator reclassify the devices on its own thread, which updates their rows and
+        # disarms the monitor once nothing unregistered is attached; the registered table refreshes from the
+        # 'registry_changed' message
+        for warning in warnings:
+            messagebox.showwarning("Warning", warning)
+        
+    def unregister_selected_devices(self):
+        selected_devices = self.registeredDeviceTable.selected_rows()
+        if not selected_devices:
+            messagebox.showwarning("Warning", "No device selected.")
+            return
+
+        with self.usb_enumerator.registry.batch():
+            for device_name, device_class, device_id in selected_devices:
+                self.usb_enumerator.remove_from_database(device_name, device_class, device_id)
+        self.registeredDeviceTable.clear_selection()
+
+    def refresh_registered_device(self):    
+        self.registeredDeviceTable.refresh()
+
+    def on_registry_changed(self, changes):
+        # Called on whichever thread committed the change. The table re-pages rather than applying the changes:
+        # an add or remove shifts every later row of the sorted, filtered view, so only a re-query places it.
+        self.usb_enumerator.queue.put(('registry_changed',))
+
+    def hide_window(self):
+        notify('SafeUSB is active', 'SafeUSB is running in the background', icon=INFO_ICON)
+        self.root.withdraw()
+        image=Image.open(APP_ICON)
+        menu=(item('Show', self.show_window), item('Quit', self.quit_program))
+        icon=pystray.Icon("name", image, "SafeUSB", menu)
+        icon.run()
+
+    def show_window(self, icon, item):
+        icon.stop()
+        self.root.after(0,lambda: self.root.deiconify())
+
+    def quit_program(self, icon, item):
+        icon.stop()
+        if self.usb_enumerator.keystroke_monitoring_process is not None and self.usb_enumerator.keystroke_monitoring_process.is_alive():
+            self.usb_enumerator.keystroke_monitoring_process.terminate()
+        self.root.destroy()
+        
+    def update_gui(self, messages):
+        registry_changed = False
+        for action, *data in messages:
+            if action == 'connect':
+                device_key, device_name, device_class, device_status, device_id = data
+                values = (device_name, device_class, device_status, device_id)
+                if device_key in self.device_rows:
+                    self.deviceTable.item(self.device_rows[device_key], values=values, tags=(device_status,))
+                else:
+                    item = self.deviceTable.insert('', 'end' if device_status == 'Safe' else 0, values=values, tags=(device_status,))
+                    self.device_rows[device_key] = item
+                    self.device_keys[item] = device_key
+            elif action == 'disconnect':
+                item = self.device_rows.pop(data[0], None)
+                if item is not None:
+                    del self.device_keys[item]
+                    self.deviceTable.delete(item)
+            elif action == 'registry_changed':
+                registry_changed = True  # Any number of commits in this batch cost one re-query
+            elif action == 'keystroke_monitoring_started':
+                    self.keystroke_status_label.config(text="Keystroke Monitoring: Active", fg="red")
+            elif action == 'keystroke_monitoring_stopped':
+                    self.keystroke_status_label.config(text="Keystroke Monitoring: Stopped", fg="green")
+            elif action in ('keyboard_blocked', 'keyboard_unblocked'):
+                self.update_block_status()
+            elif action == 'calibration':
+                self.apply_calibration(data[0])
+            elif action == 'intrusion_response_done':
+                    log.info("Intrusion response %s finished%s", data[0], "" if data[1] is None else ": " + data[1])
+        if registry_changed:
+            self.refresh_registered_device()  # VirtualTable.render only touches the rows whose contents changed
+
+    def update_block_status(self):
+        # The message only says something changed; the shared state says what is true now
+        state = self.intrusion_handler.state.snapshot()
+        detections = f" ({state['detections']} detection{'s' if state['detections'] != 1 else ''})" if state['detections'] else ""
+        if state['blocked']:
+            self.keyboard_block_status_label.config(text="Keyboard Blocked" + detections, fg="red")
+        else:
+            self.keyboard_block_status_label.config(text="Keyboard Unblocked" + detections, fg="green")
+
+class VirtualTable:
+    # Treeview that only ever holds the visible window of rows. Rows, sorting and filtering come from `source`,
+    # which provides count(filter_text) and page(offset, limit, filter_text, sort_column, descending).
+    def __init__(self, tab, columns, source, scrollbar_x, scrollbar_y, page_size=9):
+        self.source = source
+        self.page_size = page_size
+        self.offset = 0
+        self.total = 0
+        self.filter_text = ''
+        self.sort_column = None
+        self.descending = False
+        self.rows = []  # Rows currently materialized, item i shows rows[i]
+        self.selected = set()  # Selected rows, kept across scrolling
+        self.scrollbar = ttk.Scrollbar(tab, command=self.on_scroll)
+        self.scrollbar.place(x=scrollbar_x, y=scrollbar_y, height=207)
+        self.tree = ttk.Treeview(tab, selectmode="extended", show="headings", height=page_size)
+        self.tree['columns'] = columns
+        for index, col in enumerate(columns):
+            self.tree.heading(col, text=col, command=lambda index=index: self.sort_by(index))
+            self.tree.column(col, width=tkFont.Font().measure(col))
+        self.tree.place(x=10, y=10, width=647, height=207)
+        self.tree.bind('<<TreeviewSelect>>', self.on_select)
+        self.tree.bind('<MouseWheel>', self.on_mousewheel)
+        self.tree.bind('<Prior>', lambda event: self.scroll_to(self.offset - self.page_size))
+        self.tree.bind('<Next>', lambda event: self.scroll_to(self.offset + self.page_size))
+
+    def refresh(self):
+        self.total = self.source.count(self.filter_text)
+        self.scroll_to(self.offset, force=True)
+
+    def scroll_to(self, offset, force=False):
+        offset = max(0, min(offset, self.total - self.page_size))
+        if offset == self.offset and not force:
+            return
+        self.offset = offset
+        self.render(self.source.page(offset, self.page_size, self.filter_text, self.sort_column, self.descending))
+        if self.total:
+            self.scrollbar.set(self.offset / self.total, (self.offset + len(self.rows)) / self.total)
+        else:
+            self.scrollbar.set(0, 1)
+
+    def render(self, rows):
+        for index, row in enumerate(rows):
+            if index >= len(self.rows):
+                self.tree.insert('', 'end', iid=str(index), values=row)
+            elif self.rows[index] != row:
+                self.tree.item(str(index), values=row)
+        for index in range(len(rows), len(self.rows)):
+            self.tree.delete(str(index))
+        self.rows = rows
+        self.tree.selection_set([str(index) for index, row in enumerate(rows) if row in self.selected])
+
+    def on_scroll(self, *args):
+        if args[0] == 'moveto':
+            self.scroll_to(int(float(args[1]) * self.total))
+        elif args[0] == 'scroll':
+            step = self.page_size if args[2] == 'pages' else 1
+            self.scroll_to(self.offset + int(args[1]) * step)
+
+    def on_mousewheel(self, event):
+        self.scroll_to(self.offset - int(event.delta / 120) * 3)
+        return 'break'
+
+    def on_select(self, event=None):
+        selection = set(self.tree.selection())
+        for index, row in enumerate(self.rows):
+            if str(index) in selection:
+                self.selected.add(row)
+            else:
+                self.selected.discard(row)
+
+    def selected_rows(self):
+        return list(self.selected)
+
+    def clear_selection(self):
+        self.selected.clear()
+        self.tree.selection_set([])
+
+    def sort_by(self, column):
+        self.descending = not self.descending if self.sort_column == column else False
+        self.sort_column = column
+        self.offset = 0
+        self.refresh()
+
+    def set_filter(self, text):
+        self.filter_text = text.strip().lower()
+        self.offset = 0
+        self.refresh()
+
+class GuiBridge:
+    # Wakes the Tk loop only when messages arrive: a reader thread blocks on the queue and posts a virtual event,
+    # and the Tk thread then applies everything that has accumulated as one batch
+    EVENT = '<<SafeUSBMessages>>'
+
+    def __init__(self, root, queue, handler):
+        self.root = root
+        self.queue = queue
+        self.handler = handler
+        self.messages = collections.deque()
+        self.lock = threading.Lock()
+        self.signalled = False
+        self.root.bind(self.EVENT, self.drain)
+        self.thread = threading.Thread(target=self.run, name="GuiBridge", daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            message = self.queue.get()
+            with self.lock:
+                self.messages.append(message)
+                if self.signalled:
+                    continue  # A wake-up is already on its way, this message joins its batch
+                self.signalled = True
+            if not self.wake():
+                return
+
+    def wake(self):
+        while True:
+            try:
+                self.root.event_generate(self.EVENT, when='tail')
+                return True
+            except RuntimeError:
+                time.sleep(0.25)  # Tk is not dispatching yet (e.g. hidden in the tray); the messages wait until it is
+            except tk.TclError:
+                return False  # Window destroyed
+
+    def drain(self, event=None):
+        with self.lock:
+            messages = list(self.messages)
+            self.messages.clear()
+            self.signalled = False
+        self.handler(messages)
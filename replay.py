@@ -0,0 +1,344 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+import detection
+
+KEYWORDS_FILE = os.path.join(os.path.abspath(os.path.dirname(__file__)), "keywords.json")
+
+# DuckyScript key commands, mapped to the pyHook key names a Windows hook reports for them
+DUCKY_KEYS = {
+    "ENTER": "Return", "TAB": "Tab", "SPACE": "Space", "ESC": "Escape", "ESCAPE": "Escape",
+    "BACKSPACE": "Back", "DELETE": "Delete", "DEL": "Delete", "INSERT": "Insert", "HOME": "Home",
+    "END": "End", "PAGEUP": "Prior", "PAGEDOWN": "Next", "UP": "Up", "UPARROW": "Up",
+    "DOWN": "Down", "DOWNARROW": "Down", "LEFT": "Left", "LEFTARROW": "Left", "RIGHT": "Right",
+    "RIGHTARROW": "Right", "GUI": "Lwin", "WINDOWS": "Lwin", "CTRL": "Lcontrol", "CONTROL": "Lcontrol",
+    "ALT": "Lmenu", "SHIFT": "Lshift", "MENU": "Apps", "APP": "Apps", "CAPSLOCK": "Capital",
+    "PRINTSCREEN": "Snapshot", "PAUSE": "Pause", "BREAK": "Pause",
+}
+
+class KeyEvent:
+    __slots__ = ("Key", "Time")
+
+    def __init__(self, key, time):
+        self.Key = key
+        self.Time = time
+
+class ReplayConfig:
+    def __init__(self, limit, size, mode, block_allowlist='', detector='threshold', attribution='global', unlock_chord=''):
+        self.values = {('KeystrokeMonitoring', 'limit'): limit, ('KeystrokeMonitoring', 'size'): size,
+                       ('KeystrokeMonitoring', 'mode'): mode, ('KeystrokeMonitoring', 'block_allowlist'): block_allowlist,
+                       ('KeystrokeMonitoring', 'detector'): detector, ('KeystrokeMonitoring', 'attribution'): attribution,
+                       ('KeystrokeMonitoring', 'unlock_chord'): unlock_chord}
+
+    def load_int_from_config(self, section, option):
+        return self.values[(section, option)]
+
+    def load_str_from_config(self, section, option, fallback=None):
+        return self.values.get((section, option), fallback)
+
+class ReplayIntrusionHandler:
+    # Stands in for IntrusionHandler: records when the monitor would block instead of touching the system
+    def __init__(self, blocked=False, block=True):
+        self.notification_sent = False
+        self.blocked = blocked
+        self.block = block  # False keeps the monitor scoring every event, for comparing against batchscore
+        self.detections = []
+        self.unblocks = 0
+        self.events_seen = 0
+
+    def respond(self, speed=False, content=False, time=0):
+        self.blocked = self.block
+        self.detections.append(self.events_seen)
+
+    def unblock_keyboard(self):
+        self.blocked = False
+        self.unblocks += 1
+
+class FakeRawInputSource:
+    # Stands in for RawInputSource: a trace's "@device" tags are the handles, and double as the device paths
+    def device_name(self, handle):
+        return handle
+
+class ReplayMonitor(detection.KeystrokeMonitoring):
+    def __init__(self, keywords, intrusion_handler, config_handler):
+        self.replay_keywords = keywords
+        super().__init__(intrusion_handler, config_handler)
+
+    def load_keywords(self):
+        return self.replay_keywords
+
+def char_to_keys(char):
+    if char.isalpha() and char.isascii():
+        return ["Lshift", char] if char.isupper() else [char.upper()]
+    if char.isdigit():
+        return [char]
+    if char in detection.UNSHIFTED_KEYS:
+        return [detection.UNSHIFTED_KEYS[char]]
+    if char in detection.SHIFTED_KEYS:
+        return ["Lshift", detection.SHIFTED_KEYS[char]]
+    return []
+
+def parse_ducky(lines, char_delay):
+    # Converts DuckyScript into (key, time) pairs, time in milliseconds like pyHook's event.Time
+    events = []
+    now = 0
+    default_delay = 0
+    for line in lines:
+        line = line.rstrip("\r\n")
+        command, _, argument = line.partition(" ")
+        if not command or command == "REM":
+            continue
+        if command in ("DEFAULT_DELAY", "DEFAULTDELAY"):
+            default_delay = int(argument)
+            continue
+        if command == "DELAY":
+            now += int(argument)
+            continue
+        if command == "STRING":
+            for char in argument:
+                for key in char_to_keys(char):
+                    events.append((key, now))
+                    now += char_delay
+        else:
+            for token in line.split():
+                key = DUCKY_KEYS.get(token.upper())
+                if key is None:
+                    keys = char_to_keys(token) if len(token) == 1 else []
+                    key = keys[-1] if keys else token
+                events.append((key, now))
+        now += default_delay
+    return events
+
+def parse_trace(lines):
+    # Recorded typing: one "<time_ms> <key>" pair per line, '#' starts a comment.
+    # "<time_ms> <key> up" records a key release, for detectors that use dwell times, and a trailing
+    # "@<device>" names the keyboard it came from, for --attribution device.
+    events = []
+    for line in lines:
+        line = line.split("#", 1)[0].strip()
+        if not line:
+            continue
+        timestamp, key, *extra = line.split()
+        device = next((token[1:] for token in extra if token.startswith("@")), None)
+        if "up" in extra or device is not None:
+            events.append((key, int(timestamp), "up" not in extra, device))
+        else:
+            events.append((key, int(timestamp)))
+    return events
+
+def load_events(path, char_delay):
+    if path == "-":
+        lines = sys.stdin.readlines()
+    else:
+        with open(path, 'r') as f:
+            lines = f.readlines()
+    first = next((line.split() for line in lines if line.strip() and not line.startswith("#")), [""])
+    if first[0].isdigit():
+        return parse_trace(lines)
+    return parse_ducky(lines, char_delay)
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def replay(events, keywords, limit, size, mode, blocked=False, block_allowlist='', detector='threshold',
+           attribution='global', trusted=(), untrusted=(), unlock_chord=''):
+    handler = ReplayIntrusionHandler(blocked)
+    monitor = ReplayMonitor(keywords, handler, ReplayConfig(limit, size, mode, block_allowlist, detector, attribution,
+                                                            unlock_chord))
+    if monitor.attribution is not None:
+        monitor.attribution.source = FakeRawInputSource()
+        monitor.attribution.set_devices(trusted, untrusted)
+    latencies = []
+    clock = time.perf_counter_ns
+    for entry in events:
+        event = KeyEvent(entry[0], entry[1])
+        handler.events_seen += 1
+        device = entry[3] if len(entry) > 3 else None
+        if len(entry) > 2 and not entry[2]:
+            monitor.KeyUpEvent(event)
+            if monitor.attribution is not None:
+                monitor.DeviceKeyEvent(detection.RawKeyEvent(entry[0], entry[1], device, True))
+            continue
+        start = clock()
+        monitor.KeyboardEvent(event)
+        if monitor.attribution is not None:
+            # The hook only enforces the block; the tagged copy of the key press is what gets scored
+            monitor.DeviceKeyEvent(detection.RawKeyEvent(entry[0], entry[1], device))
+        latencies.append(clock() - start)
+    return handler, latencies
+
+def stream_verdicts(events, keywords, limit, size, mode):
+    # Per-event speed and verdict from the streaming monitor with blocking disabled
+    monitor = ReplayMonitor(keywords, ReplayIntrusionHandler(block=False), ReplayConfig(limit, size, mode))
+    speeds, verdicts = [], []
+    for key, timestamp in key_downs(events):
+        monitor.KeyboardEvent(KeyEvent(key, timestamp))
+        speeds.append(monitor.speed)
+        verdicts.append(monitor.speedIntrusion or monitor.contentIntrusion)
+    return speeds, verdicts
+
+def key_downs(events):
+    return [(entry[0], entry[1]) for entry in events if len(entry) < 3 or entry[2]]
+
+def verify_batch(events, keywords, args):
+    import batchscore
+    downs = key_downs(events)
+    speeds, verdicts = stream_verdicts(events, keywords, args.limit, args.size, args.mode)
+    scored = batchscore.score([t for _, t in downs], [k for k, _ in downs], keywords, args.limit, args.size, args.mode)
+    mismatches = [i for i in range(len(downs)) if bool(scored['verdict'][i]) != verdicts[i]
+                  or (i and float(scored['speed'][i]) != speeds[i])]
+    return mismatches
+
+def sweep_report(events, keywords, args):
+    import batchscore
+    downs = key_downs(events)
+    limits = [int(value) for value in args.sweep_limits.split(",")]
+    sizes = [int(value) for value in args.sweep_sizes.split(",")]
+    batchscore.load_numpy()  # Keep the one-off import out of the timing
+    start = time.perf_counter()
+    result = batchscore.sweep([t for _, t in downs], [k for k, _ in downs], keywords, limits, sizes, args.mode)
+    elapsed = time.perf_counter() - start
+    print(f"  sweep ({args.mode}, {len(downs)} keys x {len(limits) * len(sizes)} configs, {elapsed * 1000:.1f} ms): first flagged key / flagged keys")
+    print("  size\\limit " + "".join(f"{limit:>14}" for limit in limits))
+    for row, size in enumerate(sizes):
+        cells = "".join(f"{int(first) + 1 if first >= 0 else '-':>7}/{int(flagged):<6}"
+                        for first, flagged in zip(result['first'][row], result['flagged'][row]))
+        print(f"  {size:>10} " + cells)
+
+def threshold_report(events, args):
+    import batchscore
+    thresholds = [float(value) for value in args.sweep_thresholds.split(",")]
+    result = batchscore.threshold_sweep(batchscore.dynamics_scores(events, args.limit, args.size), thresholds)
+    print(f"  dynamics sweep (limit {args.limit}, size {args.size}): first flagged key / flagged keys")
+    print("  " + "".join(f"{threshold:>14}" for threshold in thresholds))
+    print("  " + "".join(f"{int(first) + 1 if first >= 0 else '-':>7}/{int(flagged):<6}"
+                         for first, flagged in zip(result['first'], result['flagged'])))
+
+def calibration_report(events, args):
+    profile = detection.TypingProfile(args.mode)
+    for _, timestamp in key_downs(events):
+        profile.add(timestamp)
+    proposal = profile.propose(args.calibrate)
+    if proposal is None:
+        print(f"  calibration    : not enough typing ({profile.keys} delays, need {profile.MIN_SAMPLES} full windows)")
+        return
+    candidates = "  ".join(f"size {size}: {limit}" for size, limit in sorted(proposal['limits'].items()))
+    print(f"  calibration    : limit {proposal['limit']}, size {proposal['size']} ({candidates})")
+
+def run(path, args, keywords, detector='threshold'):
+    events = load_events(path, args.char_delay)
+    latencies = []
+    handler = None
+    for _ in range(args.repeat):
+        handler, run_latencies = replay(events, keywords, args.limit, args.size, args.mode, args.blocked,
+                                        args.block_allowlist, detector, args.attribution,
+                                        map(detection.hardware_id, args.trusted), map(detection.hardware_id, args.untrusted),
+                                        args.unlock_chord)
+        latencies.extend(run_latencies)
+    latencies.sort()
+    total_seconds = sum(latencies) / 1e9
+
+    report = {
+        "file": path,
+        "detector": detector,
+        "events": len(events),
+        "events_per_second": round(len(latencies) / total_seconds) if total_seconds else 0,
+        "latency_us": {name: round(percentile(latencies, fraction) / 1000, 2)
+                       for name, fraction in (("p50", 0.50), ("p90", 0.90), ("p99", 0.99), ("max", 1.0))},
+        "detected": bool(handler.detections),
+        "unblocks": handler.unblocks,
+    }
+    if handler.detections:
+        index = handler.detections[0] - 1
+        report["detection_keystrokes"] = sum(1 for entry in events[:index + 1] if len(entry) < 3 or entry[2])
+        report["detection_ms"] = events[index][1] - events[0][1]
+    return report
+
+def print_report(report):
+    print(f"{report['file']} [{report['detector']}]: {report['events']} events")
+    print(f"  throughput     : {report['events_per_second']} events/s")
+    latency = report["latency_us"]
+    print(f"  latency (us)   : p50 {latency['p50']}  p90 {latency['p90']}  p99 {latency['p99']}  max {latency['max']}")
+    if report["detected"]:
+        print(f"  detected after : {report['detection_keystrokes']} keystrokes, {report['detection_ms']} ms")
+    else:
+        print("  detected after : not detected")
+    if report["unblocks"]:
+        print(f"  unlock chord   : unblocked {report['unblocks']} time(s)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay DuckyScript payloads or recorded typing traces through SafeUSB's keystroke detection.")
+    parser.add_argument("files", nargs="+", help="DuckyScript file or '<time_ms> <key>' trace, '-' for stdin")
+    parser.add_argument("--limit", type=int, default=30)
+    parser.add_argument("--size", type=int, default=10)
+    parser.add_argument("--mode", choices=detection.SpeedHistory.MODES, default="mean")
+    parser.add_argument("--detector", action="append", choices=sorted(detection.DETECTORS),
+                        help="detector to replay through; repeat to compare several (default: threshold)")
+    parser.add_argument("--attribution", choices=("global", "device"), default="global",
+                        help="score all keys as one stream, or per '@device' tag of the trace")
+    parser.add_argument("--trusted", action="append", default=[], metavar="DEVICE",
+                        help="registered keyboard (a path or VID_xxxx&PID_xxxx) whose keys --attribution device skips")
+    parser.add_argument("--untrusted", action="append", default=[], metavar="DEVICE",
+                        help="unregistered keyboard; a trusted one with the same VID/PID is monitored too")
+    parser.add_argument("--keywords", default=KEYWORDS_FILE, help="JSON keyword list")
+    parser.add_argument("--char-delay", type=int, default=0, help="milliseconds between characters of a STRING line")
+    parser.add_argument("--repeat", type=int, default=1, help="replay each file this many times for timing")
+    parser.add_argument("--blocked", action="store_true", help="start with the keyboard blocked, to time the suppression path")
+    parser.add_argument("--block-allowlist", default="", help="comma-separated keys that pass while blocked")
+    parser.add_argument("--unlock-chord", default="", help="chord that lifts the block, e.g. Ctrl+Alt+Shift+U")
+    parser.add_argument("--expect", choices=("detect", "clean"), help="fail unless every file is detected / none is")
+    parser.add_argument("--max-p99-us", type=float, help="fail if the p99 per-event latency exceeds this")
+    parser.add_argument("--json", action="store_true", help="print reports as JSON lines")
+    parser.add_argument("--sweep-limits", help="comma-separated limits to batch-score every file with (needs NumPy)")
+    parser.add_argument("--sweep-sizes", help="comma-separated window sizes for --sweep-limits")
+    parser.add_argument("--sweep-thresholds", help="comma-separated dynamics detector thresholds to score every file with (needs NumPy)")
+    parser.add_argument("--verify-batch", action="store_true", help="fail if batch scoring disagrees with the streaming monitor")
+    parser.add_argument("--calibrate", type=float, metavar="RATE",
+                        help="propose limit and size from the files' typing for this target false-block rate")
+    args = parser.parse_args()
+    if bool(args.sweep_limits) != bool(args.sweep_sizes):
+        parser.error("--sweep-limits and --sweep-sizes go together")
+
+    with open(args.keywords, 'r') as f:
+        keywords = json.load(f)
+
+    failed = False
+
+    for path in args.files:
+        for detector in args.detector or ["threshold"]:
+            report = run(path, args, keywords, detector)
+            if args.json:
+                print(json.dumps(report))
+            else:
+                print_report(report)
+            if args.expect is not None and report["detected"] != (args.expect == "detect"):
+                print(f"FAIL {path} [{detector}]: expected {args.expect}", file=sys.stderr)
+                failed = True
+            if args.max_p99_us is not None and report["latency_us"]["p99"] > args.max_p99_us:
+                print(f"FAIL {path} [{detector}]: p99 latency {report['latency_us']['p99']} us > {args.max_p99_us} us", file=sys.stderr)
+                failed = True
+        if args.calibrate is not None:
+            calibration_report(load_events(path, args.char_delay), args)
+        if args.sweep_limits or args.sweep_thresholds or args.verify_batch:
+            events = load_events(path, args.char_delay)
+        if args.sweep_limits:
+            sweep_report(events, keywords, args)
+        if args.sweep_thresholds:
+            threshold_report(events, args)
+        if args.verify_batch:
+            mismatches = verify_batch(events, keywords, args)
+            if mismatches:
+                print(f"FAIL {path}: batch scoring differs from streaming at {len(mismatches)} events, first at key {mismatches[0] + 1}", file=sys.stderr)
+                failed = True
+            else:
+                print(f"  batch scoring  : matches streaming ({args.mode}, limit {args.limit}, size {args.size})")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
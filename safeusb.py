@@ -1,296 +1,19 @@
-import tkinter as tk
-import tkinter.ttk as ttk
-import tkinter.font as tkFont
-import tkinter.messagebox as messagebox
-from usbmonitor import USBMonitor
-from usbmonitor.attributes import ID_MODEL_FROM_DATABASE, ID_USB_CLASS_FROM_DATABASE, DEVNAME
-from pystray import MenuItem as item
-import pystray
-from PIL import Image, ImageTk
-import pyWinhook as pyHook
-import pythoncom
 import multiprocessing
-from win11toast import notify
 import os
-import subprocess
 import sys
-import keyboard
-import json
-import winreg
 import configparser
-import win32evtlog
-import win32evtlogutil
-import re
-
-BUNDLE_DIR = getattr(sys, '_MEIPASS', os.path.abspath(os.path.dirname(__file__)))
-APP_ICON = os.path.abspath(os.path.join(BUNDLE_DIR, r"safeusb-data\favicon.ico"))
-WARNING_ICON = os.path.abspath(os.path.join(BUNDLE_DIR, r"safeusb-data\warning.png"))
-INFO_ICON = os.path.abspath(os.path.join(BUNDLE_DIR, r"safeusb-data\information.png")) 
+import operator
+import sqlite3
+import contextlib
+import threading
+import time
+from detection import log, setup_diagnostics, hardware_id, IntrusionHandler, KeystrokeMonitoring
 
 CWD = os.path.abspath(os.path.dirname(sys.executable))
 SAFE_DATABASE = os.path.join(CWD, "safedatabase.txt")
-KEYWORDS = os.path.join(CWD, "keywords.txt")
+SAFE_DATABASE_SQLITE = os.path.join(CWD, "safedatabase.db")
 CONFIG_FILE = os.path.join(CWD, "config.ini")
 
-class App:
-    def __init__(self, root, usb_enumerator, intrusion_handler, keymon, config_handler, registry_manager):
-        self.root = root
-        self.usb_enumerator = usb_enumerator
-        self.intrusion_handler = intrusion_handler
-        self.keymon = keymon
-        self.config_handler = config_handler
-        self.registry_manager = registry_manager
-        self.startup_checkbox = tk.IntVar()
-        self.setup_window()
-        self.setup_tab_control()
-        self.setup_device_table()
-        self.setup_registered_device_table()
-        self.setup_status_labels()
-        self.setup_buttons()
-        self.setup_autostartcheckbox()
-        self.setup_keymonconfig()
-        self.refresh_registered_device()
-
-    def setup_window(self):
-        self.root.title("SafeUSB")
-        icon = Image.open(APP_ICON)
-        icon = ImageTk.PhotoImage(icon)
-        self.root.iconphoto(True, icon)
-        width, height = 680, 290
-        screenwidth, screenheight = self.root.winfo_screenwidth(), self.root.winfo_screenheight()
-        alignstr = '%dx%d+%d+%d' % (width, height, (screenwidth - width) / 2, (screenheight - height) / 2)
-        self.root.geometry(alignstr)
-        self.root.resizable(width=False, height=False)
-
-    def setup_tab_control(self):
-        self.tabControl = ttk.Notebook(self.root)
-        self.tab1, self.tab2, self.tab3 = ttk.Frame(self.tabControl), ttk.Frame(self.tabControl), ttk.Frame(self.tabControl)
-        self.tabControl.add(self.tab1, text='Active Devices')
-        self.tabControl.add(self.tab2, text='Safe Devices')
-        self.tabControl.add(self.tab3, text='Configuration')
-        self.tabControl.pack(expand=1, fill="both")
-
-    def setup_table(self, tab, columns, scrollbar_x, scrollbar_y):
-        scrollbar = ttk.Scrollbar(tab)
-        scrollbar.place(x=scrollbar_x, y=scrollbar_y, height=207)
-        table = ttk.Treeview(tab, selectmode="extended", show="headings", yscrollcommand=scrollbar.set)
-        scrollbar.configure(command=table.yview)
-        table['columns'] = columns
-        for col in table['columns']:
-            table.heading(col, text=col)
-            table.column(col, width=tkFont.Font().measure(col))
-        table.place(x=10, y=10, width=647, height=207)
-        return table
-
-    def setup_device_table(self):
-        self.deviceTable = self.setup_table(self.tab1, ('Device Name', 'Class', 'Status', 'Device ID'), 657, 10)
-        self.deviceTable.tag_configure('Safe', background='green')
-        self.deviceTable.tag_configure('Unregistered', background='yellow')
-
-    def setup_registered_device_table(self):
-        self.registeredDeviceTable = self.setup_table(self.tab2, ('Device Name', 'Device Class', 'Device ID'), 657, 10)
-
-    def setup_status_labels(self):
-        self.keystroke_status_label = tk.Label(self.root, text="Keystroke Monitoring: Stopped", fg="green")
-        self.keystroke_status_label.place(x=320, y=253)
-
-        self.keyboard_block_status_label = tk.Label(self.root, text="Keyboard Unblocked", fg="green")
-        self.keyboard_block_status_label.place(x=520, y=253)
-
-    def setup_buttons(self):
-        self.authButton = ttk.Button(self.tab1, text="Register Device as Safe", command=self.register_selected_devices)
-        self.authButton.place(x=10, y=230)
-        self.unauthButton = ttk.Button(self.tab2, text="Unregister Device", command=self.unregister_selected_devices)
-        self.unauthButton.place(x=10, y=230)
-        
-    def setup_autostartcheckbox(self):
-        try:
-            self.startup_checkbox.set(self.config_handler.load_from_config('Autostart', 'run_at_startup'))
-        except (configparser.NoSectionError, configparser.NoOptionError):
-            self.startup_checkbox.set(self.registry_manager.check_autostart_registry("SafeUSB"))
-
-        self.chk = ttk.Checkbutton(self.tab3, text="Run at startup", variable=self.startup_checkbox, command=self.toggle_autostart)
-        self.chk.place(x=10, y=10)
-        
-    def setup_keymonconfig(self):
-        self.limit_label = ttk.Label(self.tab3, text="Keystroke speed threshold")
-        self.limit_label.place(x=10, y=50)
-        self.limit_entry = ttk.Entry(self.tab3)
-        self.limit_entry.place(x=10, y=70)
-        self.limit_entry.insert(0, self.keymon.limit)
-
-        self.size_label = ttk.Label(self.tab3, text="Keystroke size")
-        self.size_label.place(x=10, y=110)
-        self.size_entry = ttk.Entry(self.tab3)
-        self.size_entry.place(x=10, y=130)
-        self.size_entry.insert(0, self.keymon.size)
-
-        self.save_limit_button = ttk.Button(self.tab3, text="Save", command=self.save_keymonconfig)
-        self.save_limit_button.place(x=10, y=230)
-        
-    def save_keymonconfig(self):
-        limit = self.limit_entry.get()
-        size = self.size_entry.get()
-
-        if not self.validate_positive_integer(limit):
-            messagebox.showerror("Invalid Input", "Keystroke speed threshold must be a positive integer.")
-            self.limit_entry.delete(0, tk.END)
-            self.limit_entry.insert(0, self.keymon.limit)
-            return
-
-        if not self.validate_positive_integer(size):
-            messagebox.showerror("Invalid Input", "Keystroke size must be a positive integer.")
-            self.size_entry.delete(0, tk.END)
-            self.size_entry.insert(0, self.keymon.size)
-            return
-
-        limit = int(limit)
-        size = int(size)
-
-        if not (1 <= limit <= 1000):
-            messagebox.showerror("Invalid Input", "Keystroke speed threshold must be between 1 and 1000.")
-            self.limit_entry.delete(0, tk.END)
-            self.limit_entry.insert(0, self.keymon.limit)
-            return
-
-        if not (1 <= size <= 1000):
-            messagebox.showerror("Invalid Input", "Keystroke size must be between 1 and 1000.")
-            self.size_entry.delete(0, tk.END)
-            self.size_entry.insert(0, self.keymon.size)
-            return
-
-        self.keymon.limit = limit
-        self.keymon.size = size
-        self.config_handler.save_int_to_config('KeystrokeMonitoring', 'limit', limit)
-        self.config_handler.save_int_to_config('KeystrokeMonitoring', 'size', size)
-        messagebox.showwarning("Info", "Keystroke Monitoring configuration changed, SafeUSB will restart")
-        self.restart_program()
-
-    def validate_positive_integer(self, value):
-        return bool(re.match(r'^[1-9]\d*$', value))
-        
-    def toggle_autostart(self):
-        app_name = "SafeUSB"
-        key_data = sys.executable
-        autostart = self.startup_checkbox.get()
-
-        if autostart:
-            if not self.registry_manager.set_autostart_registry(app_name, key_data):
-                messagebox.showerror("Error", "Failed to set autostart.")
-        else:
-            if not self.registry_manager.set_autostart_registry(app_name, key_data, autostart=False):
-                messagebox.showerror("Error", "Failed to remove autostart.")
-
-        self.config_handler.save_to_config('Autostart', 'run_at_startup', str(autostart))
-
-    def register_selected_devices(self):
-        selected_items = self.deviceTable.selection()
-        if not selected_items:
-            messagebox.showwarning("Warning", "No device selected.")
-            return
-
-        with open(SAFE_DATABASE, 'r') as f:
-            registered_devices = [line.strip().split(',') for line in f]
-
-        for item in selected_items:
-            device_name, device_class, device_status, device_id = self.deviceTable.item(item, "values")
-            if device_status == 'Safe':
-                messagebox.showwarning("Warning", f"Device {device_name} is already registered.")
-                continue
-
-            matching_devices = [device for device in self.usb_enumerator.devices.values() if device['DEVNAME'] == device_id]
-            if not matching_devices:
-                messagebox.showwarning("Warning", f"Device {device_name} not found.")
-                continue
-
-            for device in matching_devices:
-                if any(rd[0] == device_name and rd[1] == device_class and rd[2] == device_id for rd in registered_devices):
-                    messagebox.showwarning("Warning", f"Device {device_name} is already registered.")
-                    continue
-                self.usb_enumerator.write_to_database(device_name, device_class, device_id)
-                device['Status'] = 'Safe'  # Update the 'Status' key in the device dictionary
-                self.deviceTable.set(item, 'Status', 'Safe')
-                self.deviceTable.item(item, tags=('Safe',))
-                self.refresh_registered_device()
-        # Check for unregistered devices after a device is registered
-        self.usb_enumerator.check_unregistered_devices()
-        
-    def unregister_selected_devices(self):
-        selected_items = self.registeredDeviceTable.selection()
-        if not selected_items:
-            messagebox.showwarning("Warning", "No device selected.")
-            return
-
-        for item in selected_items:
-            device_name, device_class, device_id = self.registeredDeviceTable.item(item, "values")
-            self.usb_enumerator.remove_from_database(device_name, device_class, device_id)
-            self.registeredDeviceTable.delete(item)
-        
-        messagebox.showwarning("Info", "Device(s) unregistered, SafeUSB will restart")
-        self.restart_program()
-
-    def refresh_registered_device(self):    
-        for i in self.registeredDeviceTable.get_children():
-            self.registeredDeviceTable.delete(i)
-        if not os.path.isfile(SAFE_DATABASE):
-            open(SAFE_DATABASE, 'w').close()
-        with open(SAFE_DATABASE, 'r') as f:
-            for line in f:
-                device_name, device_class, device_id = line.strip().split(',')
-                self.registeredDeviceTable.insert('', 'end', values=(device_name, device_class, device_id))   
-
-    def hide_window(self):
-        notify('SafeUSB is active', 'SafeUSB is running in the background', icon=INFO_ICON)
-        root.withdraw()
-        image=Image.open(APP_ICON)
-        menu=(item('Show', self.show_window), item('Quit', self.quit_program))
-        icon=pystray.Icon("name", image, "SafeUSB", menu)
-        icon.run()
-
-    def show_window(self, icon, item):
-        icon.stop()
-        root.after(0,lambda: root.deiconify())
-
-    def quit_program(self, icon, item):
-        icon.stop()
-        if self.usb_enumerator.keystroke_monitoring_process is not None and self.usb_enumerator.keystroke_monitoring_process.is_alive():
-            self.usb_enumerator.keystroke_monitoring_process.terminate()
-        root.destroy()
-        
-    def restart_program(self):
-        if self.usb_enumerator.keystroke_monitoring_process is not None and self.usb_enumerator.keystroke_monitoring_process.is_alive():
-            self.usb_enumerator.keystroke_monitoring_process.terminate()
-            self.usb_enumerator.keystroke_monitoring_process.join()  # Ensure the process has time to terminate
-        root.destroy()
-        python = sys.executable
-        subprocess.Popen([python] + sys.argv)
-        sys.exit()
-
-    def update_gui(self):
-        while not q.empty():
-            action, *data = q.get()
-            if action == 'connect':
-                device_name, device_class, device_status, device_id = data
-                if device_status == 'Unregistered':
-                    self.deviceTable.insert('', 0, values=(device_name, device_class, device_status, device_id), tags=(device_status,))
-                else:
-                    self.deviceTable.insert('', 'end' if device_status == 'Safe' else 0, values=(device_name, device_class, device_status, device_id), tags=(device_status,))
-            elif action == 'disconnect':
-                device_name = data[0]
-                for item in self.deviceTable.get_children():
-                    if self.deviceTable.item(item, "values")[0] == device_name:
-                        self.deviceTable.delete(item)
-                        break
-            elif action == 'keystroke_monitoring_started':
-                    self.keystroke_status_label.config(text="Keystroke Monitoring: Active", fg="red")
-            elif action == 'keystroke_monitoring_stopped':
-                    self.keystroke_status_label.config(text="Keystroke Monitoring: Stopped", fg="green")
-            elif action == 'keyboard_blocked':
-                    self.keyboard_block_status_label.config(text="Keyboard Blocked", fg="red")
-            elif action == 'keyboard_unblocked':
-                    self.keyboard_block_status_label.config(text="Keyboard Unblocked", fg="green")
-        self.root.after(100, self.update_gui)  # Schedule the next call to this function
-     
 class ConfigHandler:
     def __init__(self, config_file):
         self.config_file = config_file
@@ -300,7 +23,12 @@ class ConfigHandler:
             self.create_default_config()
             
     def create_default_config(self):
-        self.config['KeystrokeMonitoring'] = {'limit': '30', 'size': '10'}
+        self.config['KeystrokeMonitoring'] = {'limit': '30', 'size': '10', 'mode': 'mean', 'block_allowlist': '', 'detector': 'threshold',
+                                              'calibration_rate': '0.001', 'attribution': 'global',
+                                              'unlock_chord': ''}
+        self.config['SafeDatabase'] = {'backend': 'text'}
+        self.config['USBMonitoring'] = {'debounce_ms': '50', 'max_latency_ms': '200'}
+        self.config['Diagnostics'] = {'level': 'OFF'}
         with open(self.config_file, 'x+') as configfile:
             self.config.write(configfile)
 
@@ -313,6 +41,10 @@ class ConfigHandler:
         self.config.read(self.config_file)
         return self.config.getboolean(section, option)
 
+    def load_str_from_config(self, section, option, fallback=None):
+        self.config.read(self.config_file)
+        return self.config.get(section, option, fallback=fallback)
+
     def save_int_to_config(self, section, option, value):
         if not self.config.has_section(section):
             self.config.add_section(section)
@@ -320,6 +52,13 @@ class ConfigHandler:
         with open(self.config_file, 'w') as configfile:
             self.config.write(configfile)
 
+    def save_str_to_config(self, section, option, value):
+        if not self.config.has_section(section):
+            self.config.add_section(section)
+        self.config.set(section, option, value)
+        with open(self.config_file, 'w') as configfile:
+            self.config.write(configfile)
+
     def load_int_from_config(self, section, option):
         self.config.read(self.config_file)
         if self.config.has_section(section):
@@ -329,6 +68,7 @@ class ConfigHandler:
 
 class RegistryManager:    
     def set_autostart_registry(self, app_name, key_data, autostart: bool = True) -> bool:
+        import winreg
         with winreg.OpenKey(
                 key=winreg.HKEY_CURRENT_USER,
                 sub_key=r'Software\Microsoft\Windows\CurrentVersion\Run',
@@ -345,6 +85,7 @@ class RegistryManager:
         return True
 
     def check_autostart_registry(self, value_name):
+        import winreg
         with winreg.OpenKey(
                 key=winreg.HKEY_CURRENT_USER,
                 sub_key=r'Software\Microsoft\Windows\CurrentVersion\Run',
@@ -362,258 +103,507 @@ class RegistryManager:
                     break
         return False
 
+class JournaledDeviceStore:
+    # safedatabase.txt is the snapshot; changes since the last snapshot go to an append-only journal next to it
+    COMPACT_MIN_ENTRIES = 64
+
+    def __init__(self, path):
+        self.path = path
+        self.journal_path = path + ".journal"
+        self.devices = {}  # Used as an insertion-ordered set so the file order is kept
+        self.pending = []
+        self.journal_entries = 0
+        self.version = 0
+        self.filter_key = None
+        self.filter_rows = []
+        self.view_key = None
+        self.view_rows = []
+        self.load()
+
+    def load(self):
+        if not os.path.isfile(self.path):
+            open(self.path, 'x+').close()
+        with open(self.path, 'r') as f:
+            for line in f:
+                device = self.parse(line)
+                if device is not None:
+                    self.devices[device] = None
+        if os.path.isfile(self.journal_path):
+            with open(self.journal_path, 'r') as f:
+                for line in f:
+                    if not line.endswith("\n"):
+                        break  # Torn write from a crash, everything before it is intact
+                    device = self.parse(line[1:])
+                    if device is None:
+                        continue
+                    if line[0] == '+':
+                        self.devices[device] = None
+                    elif line[0] == '-':
+                        self.devices.pop(device, None)
+                    self.journal_entries += 1
+        if self.journal_entries:
+            self.compact()
+
+    def parse(self, line):
+        fields = line.strip().rsplit(',', 2)  # Device names may contain commas, class and ID never do
+        return tuple(fields) if len(fields) == 3 else None
+
+    def __contains__(self, device):
+        return device in self.devices
+
+    def __iter__(self):
+        return iter(list(self.devices))
+
+    def __len__(self):
+        return len(self.devices)
+
+    def add(self, device):
+        self.devices[device] = None
+        self.pending.append("+" + ",".join(device) + "\n")
+        self.version += 1
+
+    def remove(self, device):
+        del self.devices[device]
+        self.pending.append("-" + ",".join(device) + "\n")
+        self.version += 1
+
+    def filtered(self, filter_text):
+        # Filtered rows in file order, shared by count() and every sort order of page()
+        key = (filter_text, self.version)
+        if key != self.filter_key:
+            rows = list(self.devices)
+            if filter_text:
+                rows = [device for device in rows if any(filter_text in field.lower() for field in device)]
+            self.filter_key, self.filter_rows = key, rows
+        return self.filter_rows
+
+    def view(self, filter_text, sort_column, descending):
+        # Filtered and sorted copy, rebuilt only when the query or the contents change
+        key = (filter_text, sort_column, descending, self.version)
+        if key != self.view_key:
+            rows = self.filtered(filter_text)
+            if sort_column is not None:
+                # The whole row breaks ties, as in SQLiteDeviceStore, so equal keys never move between pages
+                sort_key = operator.itemgetter(sort_column)
+                rows = sorted(rows, key=lambda row: (sort_key(row), row), reverse=descending)
+            self.view_key, self.view_rows = key, rows
+        return self.view_rows
+
+    def count(self, filter_text=''):
+        if not filter_text:
+            return len(self.devices)
+        return len(self.filtered(filter_text))
+
+    def page(self, offset, limit, filter_text='', sort_column=None, descending=False):
+        return self.view(filter_text, sort_column, descending)[offset:offset + limit]
+
+    def commit(self):
+        # All changes made since the last commit cost one write and one fsync
+        if not self.pending:
+            return
+        with open(self.journal_path, 'a') as f:
+            f.writelines(self.pending)
+            f.flush()
+            os.fsync(f.fileno())
+        self.journal_entries += len(self.pending)
+        self.pending = []
+        if self.journal_entries > max(self.COMPACT_MIN_ENTRIES, len(self.devices)):
+            self.compact()
+
+    def compact(self):
+        # Write the snapshot to a temporary file and rename it over the old one, then start a new journal.
+        # Replaying the old journal over the new snapshot is harmless, so a crash in between loses nothing.
+        temp_path = self.path + ".tmp"
+        with open(temp_path, 'w') as f:
+            f.writelines(",".join(device) + "\n" for device in self.devices)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+        open(self.journal_path, 'w').close()
+        self.journal_entries = 0
+
+class SQLiteDeviceStore:
+    # Indexed alternative to the text database; lookups are keyed queries instead of an in-memory copy of every entry
+    def __init__(self, path, legacy_path=None):
+        is_new = not os.path.isfile(path)
+        self.connection = sqlite3.connect(path, check_same_thread=False)  # Only used through SafeDeviceRegistry, which holds its lock for every access
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS devices (name TEXT NOT NULL, class TEXT NOT NULL, id TEXT NOT NULL, PRIMARY KEY (name, class, id))")
+        if is_new and legacy_path is not None and os.path.isfile(legacy_path):
+            self.import_devices(JournaledDeviceStore(legacy_path))
+        self.device_count = self.connection.execute("SELECT COUNT(*) FROM devices").fetchone()[0]
+
+    def import_devices(self, devices):
+        self.connection.executemany("INSERT OR IGNORE INTO devices (name, class, id) VALUES (?, ?, ?)", devices)
+        self.connection.commit()
+
+    # The statements below are constant strings, so sqlite3's statement cache prepares each one only once
+    def __contains__(self, device):
+        return self.connection.execute("SELECT 1 FROM devices WHERE name = ? AND class = ? AND id = ?", device).fetchone() is not None
+
+    def __iter__(self):
+        return iter(self.connection.execute("SELECT name, class, id FROM devices ORDER BY rowid").fetchall())
+
+    def __len__(self):
+        return self.device_count
+
+    def where(self, filter_text):
+        if not filter_text:
+            return "", ()
+        return " WHERE instr(lower(name), ?) OR instr(lower(class), ?) OR instr(lower(id), ?)", (filter_text,) * 3
+
+    def count(self, filter_text=''):
+        if not filter_text:
+            return self.device_count
+        where, parameters = self.where(filter_text)
+        return self.connection.execute("SELECT COUNT(*) FROM devices" + where, parameters).fetchone()[0]
+
+    def page(self, offset, limit, filter_text='', sort_column=None, descending=False):
+        where, parameters = self.where(filter_text)
+        direction = 'DESC' if descending else 'ASC'
+        if sort_column is None:
+            order = f"rowid {direction}"
+        else:  # The primary key breaks ties, so rows with the same sort key keep their place between pages
+            order = ", ".join(f"{column} {direction}" for column in (("name", "class", "id")[sort_column], "name", "class", "id"))
+        query = f"SELECT name, class, id FROM devices{where} ORDER BY {order} LIMIT ? OFFSET ?"
+        return self.connection.execute(query, parameters + (limit, offset)).fetchall()
+
+    def add(self, device):
+        self.connection.execute("INSERT INTO devices (name, class, id) VALUES (?, ?, ?)", device)
+        self.device_count += 1
+
+    def remove(self, device):
+        self.connection.execute("DELETE FROM devices WHERE name = ? AND class = ? AND id = ?", device)
+        self.device_count -= 1
+
+    def commit(self):
+        self.connection.commit()
+
+def open_device_store(backend):
+    if backend == 'sqlite':
+        return SQLiteDeviceStore(SAFE_DATABASE_SQLITE, legacy_path=SAFE_DATABASE)
+    return JournaledDeviceStore(SAFE_DATABASE)
+
+class SafeDeviceRegistry:
+    # Safe-device index keyed by (name, class, id). Changes are written through to the store when the
+    # outermost batch() exits; add() and remove() outside a batch are committed immediately.
+    def __init__(self, store):
+        self.store = store
+        self.lock = threading.RLock()  # Shared by the usbmonitor thread and the GUI thread
+        self.batch_depth = 0
+        self.changes = []
+        self.listeners = []
+
+    # Every store access takes the lock, the SQLite store shares one connection between threads
+    def __contains__(self, device):
+        with self.lock:
+            return device in self.store
+
+    def __iter__(self):
+        with self.lock:
+            return iter(list(self.store))  # A copy, so the lock is not held while the caller iterates
+
+    def __len__(self):
+        with self.lock:
+            return len(self.store)
+
+    def count(self, filter_text=''):
+        with self.lock:
+            return self.store.count(filter_text)
+
+    def page(self, offset, limit, filter_text='', sort_column=None, descending=False):
+        with self.lock:
+            return self.store.page(offset, limit, filter_text, sort_column, descending)
+
+    def subscribe(self, listener):
+        # Listeners get one list of ('add' | 'remove', device) changes per committed batch
+        self.listeners.append(listener)
+
+    @contextlib.contextmanager
+    def batch(self):
+        changes = None
+        with self.lock:
+            self.batch_depth += 1
+            try:
+                yield self
+            finally:
+                self.batch_depth -= 1
+                if not self.batch_depth:
+                    self.store.commit()
+                    changes, self.changes = self.changes, []
+        if changes:
+            for listener in self.listeners:
+                listener(changes)
+
+    def add(self, device_name, device_class, device_id):
+        device = (device_name, device_class, device_id)
+        with self.batch():
+            if device in self.store:
+                return False
+            self.store.add(device)
+            self.changes.append(('add', device))
+            return True
+
+    def remove(self, device_name, device_class, device_id):
+        device = (device_name, device_class, device_id)
+        with self.batch():
+            if device not in self.store:
+                return False
+            self.store.remove(device)
+            self.changes.append(('remove', device))
+            return True
+
+class HotplugScheduler:
+    # Collects hot-plug callbacks until the bus has been quiet for `quiet_ms`, then hands them to `apply` as one batch.
+    # A burst is never held for longer than `max_latency_ms` after its first event.
+    def __init__(self, apply, quiet_ms=50, max_latency_ms=200):
+        self.apply = apply
+        self.quiet = min(max(quiet_ms, 10), 200) / 1000.0
+        self.max_latency = max(max_latency_ms / 1000.0, self.quiet)
+        self.pending = {}  # Latest event per device, so a connect followed by a disconnect collapses into one entry
+        self.first_event = None
+        self.last_event = None
+        self.events_received = 0
+        self.batches_applied = 0
+        self.applying = False
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run, name="HotplugScheduler", daemon=True)
+        self.thread.start()
+
+    @property
+    def events_collapsed(self):
+        return self.events_received - self.batches_applied
+
+    def submit(self, device_id, action, device_info):
+        with self.condition:
+            now = time.monotonic()
+            if not self.pending:
+                self.first_event = now
+            self.last_event = now
+            self.pending[device_id] = (action, device_info)
+            self.events_received += 1
+            self.condition.notify()
+
+    def wait_idle(self, timeout=None):
+        # Blocks until every submitted event has been applied; returns False on timeout
+        with self.condition:
+            return self.condition.wait_for(lambda: not self.pending and not self.applying, timeout)
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+                while True:
+                    now = time.monotonic()
+                    deadline = min(self.last_event + self.quiet, self.first_event + self.max_latency)
+                    if now >= deadline:
+                        break
+                    self.condition.wait(deadline - now)
+                batch, self.pending = self.pending, {}
+                self.batches_applied += 1
+                self.applying = True
+            log.info("Applying %d hot-plug event(s) in one pass, %d collapsed so far", len(batch), self.events_collapsed)
+            try:
+                self.apply(batch)
+            except Exception:
+                # One bad batch must not end hot-plug handling, or later devices would never be classified
+                log.exception("Failed to apply %d hot-plug event(s)", len(batch))
+            with self.condition:
+                self.applying = False
+                self.condition.notify_all()
+
 class USBEnumerator:
-    def __init__(self, queue, keymon, intrusion_handler, callback=None):
+    # Device state (devices, unregistered_devices, device_identities) and arming are only changed on the
+    # HotplugScheduler thread once it is running; registry changes from the GUI reach it as 'reclassify' events.
+    def __init__(self, queue, keymon, intrusion_handler, registry, callback=None, debounce_ms=50, max_latency_ms=200,
+                 usb_monitor=None):
         self.queue = queue
+        self.registry = registry
         self.callback = callback
         self.keymon = keymon
         self.intrusion_handler = intrusion_handler
-        self.usb_monitor = USBMonitor()
+        if usb_monitor is None:
+            from usbmonitor import USBMonitor
+            usb_monitor = USBMonitor()
+        self.usb_monitor = usb_monitor
         self.keystroke_monitoring_started = False
         self.keystroke_monitoring_process = None
+        self.control_queue = None
+        self.device_trust = None  # Last (trusted, unregistered) hardware ids sent to the worker
         self.devices = {}  # Store the current devices
+        self.device_identities = {}  # (name, class, id) -> keys of attached devices with that identity
+        self.unregistered_devices = set()  # Keys of attached devices whose status is 'Unregistered'
+        self.start_monitor_worker()
+        if not len(self.registry):
+            import tkinter.messagebox as messagebox
+            messagebox.showinfo("Enumerating Device", "SafeUSB is enumerating device for the first time.")
         self.usb_enum()
-        self.usb_monitor.start_monitoring(on_connect=self.usb_enum, on_disconnect=self.usb_enum)
+        self.hotplug_scheduler = HotplugScheduler(self.apply_hotplug_events, debounce_ms, max_latency_ms)
+        self.registry.subscribe(self.on_registry_changed)
+        self.usb_monitor.start_monitoring(on_connect=self.on_device_connect, on_disconnect=self.on_device_disconnect)
         
     def usb_enum(self, *args):
+        # Full reconciliation against the attached devices; hot-plug events go through the incremental handlers below
         new_devices = self.usb_monitor.get_available_devices()
-        registered_devices = self.load_registered_devices()
-
-        for key, device in new_devices.items():
-            device_name = f"{device['ID_MODEL_FROM_DATABASE']}"
-            device_class = f"{device['ID_USB_CLASS_FROM_DATABASE']}"
-            device_id = f"{device['DEVNAME']}"
-
-            if any(rd[0] == device_name and rd[1] == device_class and rd[2] == device_id for rd in registered_devices):
-                device_status = 'Safe'
-            elif device_class == 'HIDClass':
-                self.start_keystroke_monitoring()
-                device_status = 'Unregistered'                
-            else:
-                device_status = 'Safe'
-                self.write_to_database(device_name, device_class, device_id)
-
-            device['Status'] = device_status  # Store the status in the device dictionary
-
-        self.check_new_devices(new_devices, registered_devices)
-        self.check_disconnected_devices(new_devices)
-        self.devices = new_devices
+        with self.registry.batch():  # Devices auto-registered in this pass are written with a single fsync
+            for key, device in new_devices.items():
+                if key not in self.devices:
+                    self.add_device(key, device)
+            for key in list(self.devices.keys()):
+                if key not in new_devices:
+                    self.remove_device(key)
         self.check_unregistered_devices()
 
-    def load_registered_devices(self):
-        if not os.path.isfile(SAFE_DATABASE):
-            open(SAFE_DATABASE, 'x+').close()
-        with open(SAFE_DATABASE, 'r') as f:
-            registered_devices = [line.strip().split(',') for line in f]
-        if not registered_devices:
-            messagebox.showinfo("Enumerating Device", "SafeUSB is enumerating device for the first time.")
-        return registered_devices
-
-    def check_new_devices(self, new_devices, registered_devices):
-        for key, device in new_devices.items():
-            if key not in self.devices:
-                device_name = f"{device['ID_MODEL_FROM_DATABASE']}"
-                device_class = f"{device['ID_USB_CLASS_FROM_DATABASE']}"
-                device_id = f"{device['DEVNAME']}"
-
-                if any(rd[0] == device_name and rd[1] == device_class and rd[2] == device_id for rd in registered_devices):
-                    device_status = 'Safe'
-                elif device_class == 'HIDClass':
-                    self.start_keystroke_monitoring()
-                    device_status = 'Unregistered'
-                else:
-                    device_status = 'Safe'
-                    self.write_to_database(device_name, device_class, device_id)
+    def on_device_connect(self, device_id, device_info):
+        self.hotplug_scheduler.submit(device_id, 'connect', device_info)
+
+    def on_device_disconnect(self, device_id, device_info):
+        self.hotplug_scheduler.submit(device_id, 'disconnect', device_info)
+
+    def apply_hotplug_events(self, events):
+        with self.registry.batch():
+            for device_id, (action, device_info) in events.items():
+                if action == 'connect' and device_id not in self.devices:
+                    self.add_device(device_id, device_info)
+                elif action == 'disconnect' and device_id in self.devices:
+                    self.remove_device(device_id)
+                elif action == 'reclassify':
+                    for key in list(self.device_identities.get(device_info, ())):
+                        self.add_device(key, self.devices[key])
+        self.check_unregistered_devices()
 
-                device['Status'] = device_status  # Store the status in the device dictionary
-                self.queue.put(('connect', device_name, device_class, device_status, device_id))
+    def on_registry_changed(self, changes):
+        # Runs on whichever thread committed the change. Attached devices with a registered or unregistered identity
+        # are classified again on the scheduler thread, keyed by identity so they never collapse with a device id.
+        for change, device in changes:
+            self.hotplug_scheduler.submit(device, 'reclassify', device)
+
+    def device_identity(self, device):
+        return (f"{device['ID_MODEL_FROM_DATABASE']}", f"{device['ID_USB_CLASS_FROM_DATABASE']}", f"{device['DEVNAME']}")
+
+    def classify_device(self, device):
+        device_name, device_class, device_id = self.device_identity(device)
+
+        if (device_name, device_class, device_id) in self.registry:
+            return 'Safe'
+        if device_class == 'HIDClass':
+            self.start_keystroke_monitoring()
+            return 'Unregistered'
+        self.write_to_database(device_name, device_class, device_id)
+        return 'Safe'
+
+    def add_device(self, key, device):
+        device['Status'] = self.classify_device(device)  # Store the status in the device dictionary
+        self.devices[key] = device
+        self.device_identities.setdefault(self.device_identity(device), set()).add(key)
+        if device['Status'] == 'Unregistered':
+            self.unregistered_devices.add(key)
+        else:
+            self.unregistered_devices.discard(key)
+        self.queue.put(('connect', key, device['ID_MODEL_FROM_DATABASE'], device['ID_USB_CLASS_FROM_DATABASE'], device['Status'], device['DEVNAME']))
+
+    def remove_device(self, key):
+        device = self.devices.pop(key)
+        self.unregistered_devices.discard(key)
+        keys = self.device_identities[self.device_identity(device)]
+        keys.discard(key)
+        if not keys:
+            del self.device_identities[self.device_identity(device)]
+        self.queue.put(('disconnect', key))
+
+    def start_monitor_worker(self):
+        # The monitor process is started once and kept warm, so arming it is a single control message
+        self.control_queue = multiprocessing.Queue()
+        self.device_trust = None
+        self.keystroke_monitoring_process = multiprocessing.Process(target=self.keymon.start, args=(self.control_queue,))
+        self.keystroke_monitoring_process.daemon = True  # Make the process daemonic
+        self.keystroke_monitoring_process.start()
 
     def start_keystroke_monitoring(self):
         if not self.keystroke_monitoring_started:
-            self.keystroke_monitoring_process = multiprocessing.Process(target=keymon.start)
-            self.keystroke_monitoring_process.daemon = True  # Make the process daemonic
-            self.keystroke_monitoring_process.start()
+            if self.keystroke_monitoring_process is None or not self.keystroke_monitoring_process.is_alive():
+                self.start_monitor_worker()
+            self.control_queue.put(('arm',))
             self.keystroke_monitoring_started = True
             self.queue.put(('keystroke_monitoring_started',))  
 
-    def check_disconnected_devices(self, new_devices):
-        for key in list(self.devices.keys()):
-            if key not in new_devices:
-                self.queue.put(('disconnect', self.devices[key]['ID_MODEL_FROM_DATABASE']))
-
     def check_unregistered_devices(self):
-        unregistered_devices_left = any(device['Status'] == 'Unregistered' for device in self.devices.values())
-        if not unregistered_devices_left and self.keystroke_monitoring_started:
+        if not self.unregistered_devices and self.keystroke_monitoring_started:
+            self.send_control('unblock')
             self.terminate_keystroke_monitoring()
-            self.intrusion_handler.unblock_keyboard()
+        elif self.keystroke_monitoring_started and self.keymon.attribution is not None:
+            self.update_device_trust()
+
+    def update_device_trust(self):
+        # Tells a per-keyboard monitor which attached keyboards are registered and which are not
+        trusted, untrusted = set(), set()
+        for key, device in self.devices.items():
+            device_id = hardware_id(device['DEVNAME'])
+            if device_id is not None:
+                (untrusted if key in self.unregistered_devices else trusted).add(device_id)
+        device_trust = (frozenset(trusted), frozenset(untrusted))
+        if device_trust != self.device_trust:
+            self.device_trust = device_trust
+            self.send_control('devices', *device_trust)
+
+    def send_control(self, *message):
+        # Live updates for the worker; a worker started later picks up the parent's keymon state instead.
+        # Returns whether the message was sent.
+        if self.keystroke_monitoring_process is not None and self.keystroke_monitoring_process.is_alive():
+            self.control_queue.put(message)
+            return True
+        return False
+
+    def update_keystroke_monitoring(self, limit, size, mode):
+        self.keymon.configure(limit, size, mode)
+        self.send_control('config', limit, size, mode)
+
+    def calibrate(self, *command):
+        # Calibration state lives in the worker only, so there is nothing to fall back on when it is not running
+        return self.send_control('calibrate', *command)
+
+    def update_keywords(self, keywords):
+        self.keymon.set_keywords(keywords)
+        self.send_control('keywords', keywords)
 
     def terminate_keystroke_monitoring(self):
-        if self.keystroke_monitoring_process is not None and self.keystroke_monitoring_process.is_alive():
-            self.keystroke_monitoring_process.terminate()
+        self.send_control('disarm')
         self.keystroke_monitoring_started = False
         self.queue.put(('keystroke_monitoring_stopped',)) 
 
     def write_to_database(self, device_name, device_class, device_id):
-        devices = self.read_database()
-        new_device = f"{device_name},{device_class},{device_id}\n"
-        if new_device not in devices:
-            self.append_to_database(new_device)
+        if self.registry.add(device_name, device_class, device_id):
             if self.callback:
                 self.callback()
                 
     def remove_from_database(self, device_name, device_class, device_id):
-        devices = self.read_database()
-        device = f"{device_name},{device_class},{device_id}\n"
-        if device in devices:
-            devices.remove(device)
-            with open(SAFE_DATABASE, 'w') as f:
-                f.writelines(devices)
+        if self.registry.remove(device_name, device_class, device_id):
             if self.callback:
                 self.callback()
 
-    def read_database(self):
-        if not os.path.isfile(SAFE_DATABASE):
-            open(SAFE_DATABASE, 'w').close()
-        with open(SAFE_DATABASE, 'r') as f:
-            devices = f.readlines()
-        return devices
-
-    def append_to_database(self, new_device):
-        if not os.path.isfile(SAFE_DATABASE):
-            open(SAFE_DATABASE, 'w').close()
-        with open(SAFE_DATABASE, 'a') as f:
-            f.write(new_device)
-
-class IntrusionHandler:
-    def __init__(self, queue):
-        self.queue = queue
-        self.notification_sent = False
-
-    def send_intrusion_warning(self):
-        messagebox.showwarning("Intrusion Detected by SafeUSB", "Possible HID keystroke injection by BadUSB detected.\n\nAll keyboard input will be blocked.\n\nTo unblock, register any unregistered device (if you believe this warning is a false positive) or immediately check your physical USB port and disconnect any malicious device")
-        notify('Intrusion Detected', 'HID keystroke injection by BadUSB detected', icon=WARNING_ICON)
-
-    def write_to_event_log(self):
-        # Define the event source detailspowershell
-        source = 'SafeUSB'
-        event_id = 1337  # The security ID structure is invalid.
-        descr = ["HID keystroke injection by BadUSB detected"]
-        # Write to the event log
-        win32evtlogutil.ReportEvent(source, event_id, eventType=win32evtlog.EVENTLOG_WARNING_TYPE, strings=descr, data=None)
-    
-    def block_keyboard(self):
-        for i in range(150):
-            keyboard.block_key(i) 
-        self.queue.put(('keyboard_blocked',)) 
-    
-    def unblock_keyboard(self):
-        keyboard.unhook_all()
-        self.queue.put(('keyboard_unblocked',)) 
-
-class KeystrokeMonitoring:
-    def __init__(self, intrusion_handler, config_handler):
-        self.intrusion_handler = intrusion_handler # Create an instance of IntrusionHandler
-        self.config_handler = config_handler
-        self.limit = self.config_handler.load_int_from_config('KeystrokeMonitoring', 'limit')
-        self.size = self.config_handler.load_int_from_config('KeystrokeMonitoring', 'size')
-        self.speed = 0
-        self.prev = -1
-        self.i = 0
-        self.speedIntrusion = False
-        self.history = [self.limit+1] * self.size
-        self.keylogged = "".lower()
-        self.keyWords = self.read_keywords()
-        self.contentIntrusion = False
-    
-    def read_keywords(self):
-        filename = KEYWORDS
-        default_keywords = ["POWERSHELL", "CMD.EXE", "USER", "HOSTNAME", "TASK", "NEWOem_MinusOBJECT", "LwinX", "LwinR", "LcontrolLmenuDelete"]
-
-        # Check if file exists
-        if not os.path.exists(filename):
-            with open(filename, 'x+') as f:
-                json.dump(default_keywords, f)
-            return default_keywords
-
-        # Load keywords from file
-        with open(filename, 'r') as f:
-            try:
-                keywords = json.load(f)
-                # If file is empty, write the default keywords
-                if not keywords:
-                    raise ValueError("Keyword list is empty")
-            except Exception as e:
-                messagebox.showerror("Error", str(e))
-                with open(filename, 'w') as f:
-                    json.dump(default_keywords, f)
-                return default_keywords
-        return keywords
-
-    def KeyboardEvent(self, event):
-        self.log_key(event.Key)
-        self.detect_keywords()
-        self.calculate_speed(event.Time)
-        self.detect_intrusion()
-        return True
-
-    def log_key(self, key):
-        print("Keystroke : " + key)
-        self.keylogged += key
-
-    def detect_keywords(self):
-        for word in self.keyWords:
-            if word in self.keylogged:
-                print(f"[*] Key Words Detected: [{word}]")
-                self.contentIntrusion = True
-                self.keylogged = ""
-
-    def calculate_speed(self, time):
-        if (self.prev == -1):
-            self.prev = time
-            return
-
-        if (self.i >= len(self.history)): self.i = 0
-
-        self.history[self.i] = time - self.prev
-        print(time, "-", self.prev, "=", self.history[self.i])
-        self.prev = time
-        self.speed = sum(self.history) / float(len(self.history))
-        self.i = self.i + 1
-
-        print("\rAverage Typing Speed:", self.speed)
-
-        if (self.speed < self.limit):
-            self.speedIntrusion = True
-        else:
-            self.speedIntrusion = False
-
-    def detect_intrusion(self):
-        if (self.speedIntrusion or self.contentIntrusion) and not self.intrusion_handler.notification_sent:
-            self.intrusion_handler.write_to_event_log()
-            self.intrusion_handler.block_keyboard()
-            self.intrusion_handler.send_intrusion_warning()
-            self.intrusion_handler.notification_sent = True
-        elif not self.speedIntrusion and not self.contentIntrusion:
-            self.intrusion_handler.notification_sent = False
-
-    def start(self):
-        keyhook = pyHook.HookManager()
-        keyhook.KeyDown = self.KeyboardEvent
-        keyhook.HookKeyboard()
-        pythoncom.PumpMessages()
-
 if __name__ == "__main__":
     multiprocessing.freeze_support() #freeze_support must be enabled when compiling to exe with pyinstaller with multiprocessing
+    # GUI, USB and registry libraries are only imported by the GUI process: the window lives in gui.py and the
+    # rest is imported where it is used. Spawned workers re-import this file as __mp_main__ and skip this block,
+    # so they only pay for the detection module.
+    import tkinter as tk
+    from gui import App, GuiBridge
+
     root = tk.Tk()
     config_handler = ConfigHandler(CONFIG_FILE)
+    setup_diagnostics(config_handler.load_str_from_config('Diagnostics', 'level', 'OFF'))
     registry_manager = RegistryManager()
     q = multiprocessing.Queue()
     handler = IntrusionHandler(q)
     keymon = KeystrokeMonitoring(handler, config_handler)
-    usb_enumerator = USBEnumerator(q, keymon, handler)
+    registry = SafeDeviceRegistry(open_device_store(config_handler.load_str_from_config('SafeDatabase', 'backend', 'text')))
+    debounce_ms = int(config_handler.load_str_from_config('USBMonitoring', 'debounce_ms', '50'))
+    max_latency_ms = int(config_handler.load_str_from_config('USBMonitoring', 'max_latency_ms', '200'))
+    usb_enumerator = USBEnumerator(q, keymon, handler, registry, debounce_ms=debounce_ms, max_latency_ms=max_latency_ms)
     app = App(root, usb_enumerator, handler, keymon, config_handler, registry_manager)
     root.protocol('WM_DELETE_WINDOW', app.hide_window)
     
-    app.update_gui()  # Start the periodic call to the function
+    GuiBridge(root, q, app.update_gui)  # Apply queued messages to the GUI as they arrive
     app.hide_window()  # Add this line to hide the window on startup
     root.mainloop()
\ No newline at end of file
@@ -0,0 +1,57 @@
+import detection
+from replay import FakeRawInputSource, KeyEvent, ReplayConfig, ReplayIntrusionHandler, ReplayMonitor
+
+KEYBOARD = r"\\?\HID#VID_046D&PID_C31C#7&1a2b"
+BADUSB = r"\\?\HID#VID_1B4F&PID_9208#7&3c4d"
+
+def device_monitor(detector='threshold', limit=30):
+    handler = ReplayIntrusionHandler(block=False)
+    monitor = ReplayMonitor(["zzqqzz"], handler, ReplayConfig(limit, 10, 'mean', detector=detector, attribution='device'))
+    monitor.attribution.source = FakeRawInputSource()
+    return monitor, handler
+
+def type_keys(monitor, device, keys, start, delay, dwell=None):
+    now = start
+    for key in keys:
+        monitor.KeyboardEvent(KeyEvent(key, now))
+        monitor.DeviceKeyEvent(detection.RawKeyEvent(key, now, device))
+        if dwell is not None:
+            monitor.DeviceKeyEvent(detection.RawKeyEvent(key, now + dwell, device, True))
+        now += delay
+    return now
+
+def test_channels_run_the_configured_detector():
+    monitor, handler = device_monitor(detector='dynamics')
+    type_keys(monitor, BADUSB, "POWERSHELLXYZ", 0, 8, dwell=2)
+    channel = monitor.attribution.channels[BADUSB]
+    assert isinstance(channel.detector, detection.DynamicsDetector)
+    assert channel.detector is not monitor.detector
+    assert channel.detector.score >= channel.detector.engine.threshold
+    assert handler.detections
+
+def test_threshold_channels_have_no_detector():
+    monitor, handler = device_monitor()
+    type_keys(monitor, KEYBOARD, "ABC", 0, 200)
+    assert monitor.attribution.channels[KEYBOARD].detector is None
+    assert not handler.detections
+
+def test_set_devices_only_drops_channels_whose_trust_changed():
+    monitor, handler = device_monitor()
+    type_keys(monitor, KEYBOARD, "ABC", 0, 200)
+    type_keys(monitor, BADUSB, "ABC", 1000, 200)
+    badusb_channel = monitor.attribution.channels[BADUSB]
+    monitor.attribution.set_devices(["VID_046D&PID_C31C"], [])
+    assert KEYBOARD not in monitor.attribution.channels
+    assert monitor.attribution.channels[BADUSB] is badusb_channel
+    assert badusb_channel.prev == 1400
+    type_keys(monitor, KEYBOARD, "D", 2000, 200)
+    assert monitor.attribution.channels[KEYBOARD] is None
+
+def test_untrusting_a_clone_brings_its_channel_back():
+    monitor, handler = device_monitor()
+    monitor.attribution.set_devices(["VID_046D&PID_C31C"], [])
+    type_keys(monitor, KEYBOARD, "A", 0, 200)
+    assert monitor.attribution.channels[KEYBOARD] is None
+    monitor.attribution.set_devices(["VID_046D&PID_C31C"], ["VID_046D&PID_C31C"])
+    type_keys(monitor, KEYBOARD, "B", 200, 200)
+    assert isinstance(monitor.attribution.channels[KEYBOARD], detection.DeviceChannel)
@@ -0,0 +1,54 @@
+import random
+
+import pytest
+
+import detection
+from replay import stream_verdicts
+
+np = pytest.importorskip("numpy")
+import batchscore  # noqa: E402
+
+KEYWORDS = ["POWERSHELL", "Win+R", "1+1"]
+NO_KEYWORDS = ["ZZQQZZ"]  # Speed verdicts only
+
+def trace(seed, keys=300):
+    # Human-speed typing with injected-speed bursts, and a keyword now and then
+    rng = random.Random(seed)
+    now = 0
+    events = []
+    words = ["POWERSHELL", "HELLO", "WORLD", "TYPING", "SPEED"]
+    while len(events) < keys:
+        burst = rng.random() < 0.2
+        for key in rng.choice(words):
+            events.append((key, now))
+            now += rng.randint(5, 40) if burst else rng.randint(90, 400)
+        events.append(("Space", now))
+        now += rng.randint(100, 900)
+    return events
+
+@pytest.mark.parametrize("keywords", [KEYWORDS, NO_KEYWORDS])
+@pytest.mark.parametrize("mode", detection.SpeedHistory.MODES)
+@pytest.mark.parametrize("limit, size", [(30, 10), (60, 5), (120, 3)])
+def test_score_matches_the_streaming_monitor(keywords, mode, limit, size):
+    events = trace(limit + size)
+    speeds, verdicts = stream_verdicts(events, keywords, limit, size, mode)
+    scored = batchscore.score([t for _, t in events], [k for k, _ in events], keywords, limit, size, mode)
+    assert scored['verdict'].tolist() == verdicts
+    assert scored['speed'][1:].tolist() == speeds[1:]
+
+@pytest.mark.parametrize("mode", detection.SpeedHistory.MODES)
+def test_sweep_matches_score_for_every_combination(mode):
+    events = trace(7)
+    times, keys = [t for _, t in events], [k for k, _ in events]
+    limits, sizes = [20, 40, 80, 160], [3, 10]
+    result = batchscore.sweep(times, keys, NO_KEYWORDS, limits, sizes, mode)
+    for row, size in enumerate(sizes):
+        for column, limit in enumerate(limits):
+            verdicts = stream_verdicts(events, NO_KEYWORDS, limit, size, mode)[1]
+            first = verdicts.index(True) if True in verdicts else -1
+            assert result['first'][row, column] == first
+            assert result['flagged'][row, column] == sum(verdicts)
+
+def test_keyword_flags_stay_set_after_a_match():
+    flags = batchscore.keyword_flags(["A", "1", "Lshift", "Oem_Plus", "1", "B"], ["1+1"])
+    assert flags.tolist() == [False, False, False, False, True, True]
@@ -0,0 +1,101 @@
+import pytest
+
+from safeusb import JournaledDeviceStore, SQLiteDeviceStore
+
+DEVICES = [
+    ("USB Keyboard", "HIDClass", "USB\\VID_046D&PID_C31C\\1"),
+    ("Mass Storage, Kingston", "USB", "USB\\VID_0951&PID_1666\\2"),
+    ("USB Mouse", "HIDClass", "USB\\VID_046D&PID_C077\\3"),
+]
+
+@pytest.fixture
+def store(tmp_path):
+    store = JournaledDeviceStore(str(tmp_path / "safedatabase.txt"))
+    for device in DEVICES:
+        store.add(device)
+    store.commit()
+    return store
+
+def test_page_sorts_and_filters(store):
+    assert store.page(0, 10, "vid_046d", 0, False) == sorted([DEVICES[0], DEVICES[2]])
+    assert store.page(0, 1, "", 0, True) == [DEVICES[2]]
+    assert store.count("hidclass") == 2
+
+def test_count_and_sorted_page_share_the_filtered_rows(store):
+    store.page(0, 10, "hid", 0, True)
+    filtered = store.filter_rows
+    assert store.count("hid") == 2
+    store.page(0, 10, "hid", 2, False)
+    assert store.filter_rows is filtered  # Neither the count nor a new sort order filtered again
+
+def test_view_is_rebuilt_after_a_change(store):
+    assert store.count("mouse") == 1
+    store.remove(DEVICES[2])
+    assert store.count("mouse") == 0
+    assert store.page(0, 10, "mouse") == []
+
+def test_committed_changes_survive_a_reopen(store):
+    store.remove(DEVICES[1])
+    store.commit()
+    assert list(JournaledDeviceStore(store.path)) == [DEVICES[0], DEVICES[2]]
+
+def test_uncommitted_changes_are_not_written(store):
+    store.remove(DEVICES[0])
+    assert list(JournaledDeviceStore(store.path)) == DEVICES
+
+def test_reopening_replays_the_journal_into_the_snapshot(store):
+    with open(store.journal_path) as f:
+        assert len(f.readlines()) == len(DEVICES)
+    reopened = JournaledDeviceStore(store.path)
+    assert reopened.journal_entries == 0
+    with open(store.journal_path) as f:
+        assert f.read() == ""
+    with open(store.path) as f:
+        assert [reopened.parse(line) for line in f] == DEVICES
+
+def test_commit_compacts_once_the_journal_outgrows_the_snapshot(tmp_path):
+    store = JournaledDeviceStore(str(tmp_path / "safedatabase.txt"))
+    for i in range(JournaledDeviceStore.COMPACT_MIN_ENTRIES):
+        device = ("Keyboard %d" % i, "HIDClass", "USB\\VID_046D&PID_C31C\\%d" % i)
+        store.add(device)
+        store.commit()
+    assert store.journal_entries == JournaledDeviceStore.COMPACT_MIN_ENTRIES
+    store.remove(device)
+    store.commit()
+    assert store.journal_entries == 0
+    assert len(JournaledDeviceStore(store.path)) == JournaledDeviceStore.COMPACT_MIN_ENTRIES - 1
+
+def test_torn_journal_write_keeps_everything_before_it(store):
+    with open(store.journal_path, 'a') as f:
+        f.write("-" + ",".join(DEVICES[0]) + "\n")
+        f.write("-" + ",".join(DEVICES[1]))  # Crashed before the newline
+    assert list(JournaledDeviceStore(store.path)) == [DEVICES[1], DEVICES[2]]
+
+def test_crash_between_snapshot_and_journal_reset_loses_nothing(store):
+    store.remove(DEVICES[2])
+    store.commit()
+    with open(store.journal_path) as f:
+        journal = f.read()
+    store.compact()
+    with open(store.journal_path, 'w') as f:
+        f.write(journal)  # The old journal is still there when the new snapshot lands
+    assert list(JournaledDeviceStore(store.path)) == [DEVICES[0], DEVICES[1]]
+
+def test_device_names_with_commas_round_trip(store):
+    reopened = JournaledDeviceStore(store.path)
+    assert DEVICES[1] in reopened
+
+@pytest.mark.parametrize("descending", [False, True])
+@pytest.mark.parametrize("sort_column", [0, 1, 2])
+def test_both_backends_page_ties_the_same_way(tmp_path, sort_column, descending):
+    devices = [("Keyboard %d" % (i % 3), "HIDClass" if i % 2 else "USB", "USB\\VID_046D&PID_C31C\\%02d" % (17 - i))
+               for i in range(18)]
+    text = JournaledDeviceStore(str(tmp_path / "safedatabase.txt"))
+    sqlite = SQLiteDeviceStore(str(tmp_path / "safedatabase.db"))
+    for device in devices:
+        text.add(device)
+        sqlite.add(device)
+    pages = [text.page(offset, 4, '', sort_column, descending) for offset in range(0, 18, 4)]
+    rows = [row for page in pages for row in page]
+    assert sorted(rows) == sorted(devices)  # Nothing duplicated or skipped across pages
+    assert [sqlite.page(offset, 4, '', sort_column, descending) for offset in range(0, 18, 4)] == pages
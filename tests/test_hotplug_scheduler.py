@@ -0,0 +1,70 @@
+import threading
+import time
+
+from safeusb import HotplugScheduler
+
+class Recorder:
+    def __init__(self, fail_first=False):
+        self.batches = []
+        self.times = []
+        self.fail_first = fail_first
+        self.applied = threading.Event()
+
+    def __call__(self, batch):
+        self.batches.append(batch)
+        self.times.append(time.monotonic())
+        self.applied.set()
+        if self.fail_first and len(self.batches) == 1:
+            raise KeyError("device vanished")
+
+def wait_for_batches(recorder, count, timeout=5):
+    deadline = time.monotonic() + timeout
+    while len(recorder.batches) < count and time.monotonic() < deadline:
+        time.sleep(0.005)
+    return len(recorder.batches)
+
+def test_a_burst_is_applied_once():
+    recorder = Recorder()
+    scheduler = HotplugScheduler(recorder, quiet_ms=50, max_latency_ms=1000)
+    for i in range(5):
+        scheduler.submit("USB\\%d" % i, 'connect', {'n': i})
+    assert wait_for_batches(recorder, 1) == 1
+    time.sleep(0.1)
+    assert len(recorder.batches) == 1
+    assert list(recorder.batches[0]) == ["USB\\%d" % i for i in range(5)]
+    assert scheduler.events_collapsed == 4
+
+def test_later_events_for_a_device_replace_earlier_ones():
+    recorder = Recorder()
+    scheduler = HotplugScheduler(recorder, quiet_ms=50, max_latency_ms=1000)
+    scheduler.submit("USB\\1", 'connect', {})
+    scheduler.submit("USB\\1", 'disconnect', {})
+    wait_for_batches(recorder, 1)
+    assert recorder.batches[0] == {"USB\\1": ('disconnect', {})}
+    assert scheduler.events_collapsed == 1
+
+def test_max_latency_bounds_the_delay_under_a_continuous_stream():
+    recorder = Recorder()
+    scheduler = HotplugScheduler(recorder, quiet_ms=50, max_latency_ms=150)
+    start = time.monotonic()
+    i = 0
+    while not recorder.applied.is_set() and time.monotonic() - start < 2:
+        scheduler.submit("USB\\%d" % i, 'connect', {})
+        i += 1
+        time.sleep(0.01)  # Never quiet for 50 ms
+    assert recorder.batches
+    assert recorder.times[0] - start < 0.15 + 0.1
+
+def test_quiet_window_is_clamped():
+    assert HotplugScheduler(Recorder(), quiet_ms=1).quiet == 0.01
+    assert HotplugScheduler(Recorder(), quiet_ms=5000).quiet == 0.2
+    assert HotplugScheduler(Recorder(), quiet_ms=50, max_latency_ms=10).max_latency == 0.05
+
+def test_a_failing_batch_does_not_stop_the_scheduler():
+    recorder = Recorder(fail_first=True)
+    scheduler = HotplugScheduler(recorder, quiet_ms=10, max_latency_ms=50)
+    scheduler.submit("USB\\1", 'connect', {})
+    assert wait_for_batches(recorder, 1) == 1
+    scheduler.submit("USB\\2", 'connect', {})
+    assert wait_for_batches(recorder, 2) == 2
+    assert scheduler.thread.is_alive()
@@ -0,0 +1,71 @@
+import multiprocessing
+import queue
+
+import detection
+
+class QuietHandler(detection.IntrusionHandler):
+    # No event log or message box, only the state and the GUI messages
+    def write_to_event_log(self):
+        pass
+
+    def send_intrusion_warning(self):
+        pass
+
+class CheckingQueue(queue.Queue):
+    # Records what a GUI reading the shared state would see when each message arrives
+    def __init__(self, state):
+        super().__init__()
+        self.state = state
+        self.seen = []
+
+    def put(self, item, *args, **kwargs):
+        self.seen.append((item[0], self.state.snapshot()))
+        super().put(item, *args, **kwargs)
+
+def test_snapshot_counts_blocks_and_detections():
+    state = detection.IntrusionState()
+    assert state.snapshot() == {'blocked': False, 'armed': False, 'detections': 0, 'speed_detections': 0,
+                                'content_detections': 0, 'last_detection_time': 0, 'alerts_shown': 0}
+    state.set_armed(True)
+    state.record_block(True, False, 1000)
+    state.record_block(True, True, 2000)
+    state.record_alert()
+    snapshot = state.snapshot()
+    assert snapshot['blocked'] and snapshot['armed']
+    assert (snapshot['detections'], snapshot['speed_detections'], snapshot['content_detections']) == (2, 2, 1)
+    assert snapshot['last_detection_time'] == 2000
+    assert snapshot['alerts_shown'] == 1
+
+def test_unblock_releases_every_block_so_far():
+    state = detection.IntrusionState()
+    state.record_block(True, False, 1000)
+    state.record_block(False, True, 1500)
+    state.record_unblock()
+    assert not state.blocked
+    state.record_block(True, False, 3000)
+    assert state.blocked
+
+def test_block_is_recorded_before_the_gui_is_told():
+    handler = QuietHandler(None)
+    handler.queue = CheckingQueue(handler.state)
+    handler.respond(speed=True, time=1234)
+    handler.executor.shutdown(wait=True)
+    message, snapshot = handler.queue.seen[0]
+    assert message == 'keyboard_blocked'
+    assert snapshot['blocked'] and snapshot['last_detection_time'] == 1234
+    handler.unblock_keyboard()
+    message, snapshot = handler.queue.seen[-1]
+    assert message == 'keyboard_unblocked'
+    assert not snapshot['blocked']
+
+def block_in_worker(state):
+    state.record_block(False, True, 42)
+
+def test_state_is_shared_with_a_spawned_worker():
+    state = detection.IntrusionState()
+    worker = multiprocessing.get_context('spawn').Process(target=block_in_worker, args=(state,))
+    worker.start()
+    worker.join(30)
+    assert worker.exitcode == 0
+    assert state.blocked
+    assert state.snapshot()['content_detections'] == 1
@@ -0,0 +1,76 @@
+import pytest
+
+import detection
+
+@pytest.mark.parametrize("keyword, keys", [
+    ("1+1", ["1", "Oem_Plus", "1"]),
+    ("a+b", ["A", "Oem_Plus", "B"]),
+    ("C++", ["C", "Oem_Plus", "Oem_Plus"]),
+    ("Win+R", ["Lwin", "R"]),
+    ("Ctrl + Alt + Del", ["Lcontrol", "Lmenu", "Delete"]),
+    ("Shift+F10", []),
+    ("Ctrl+Shift+Esc", []),
+    ("Alt+F4", ["Lmenu", "F4"]),
+    ("New-Object", ["N", "E", "W", "Oem_Minus", "O", "B", "J", "E", "C", "T"]),
+    ("NEWOem_MinusOBJECT", ["N", "E", "W", "Oem_Minus", "O", "B", "J", "E", "C", "T"]),
+    ("LwinR", ["Lwin", "R"]),
+    ("Total+Tax", ["T", "O", "T", "A", "L", "Oem_Plus", "T", "A", "X"]),
+])
+def test_keyword_keys(keyword, keys):
+    assert detection.keyword_keys(keyword) == keys
+
+def feed(matcher, keys):
+    matches = []
+    for key in keys:
+        word = matcher.feed(matcher.key_tokens.token(key))
+        if word is not None:
+            matches.append(word)
+    return matches
+
+def test_text_with_plus_matches_the_typed_plus_only():
+    matcher = detection.KeywordMatcher(["1+1"])
+    assert feed(matcher, ["1", "1"]) == []
+    assert feed(matcher, ["1", "Lshift", "Oem_Plus", "1"]) == ["1+1"]
+
+def test_shift_chords_never_match_the_bare_key():
+    matcher = detection.KeywordMatcher(["Shift+F10", "Shift+Tab", "Ctrl+Shift+Esc"])
+    assert feed(matcher, ["F10", "Tab", "Lcontrol", "Escape"]) == []
+    assert feed(matcher, ["Lshift", "F10", "Rshift", "Tab", "Lcontrol", "Lshift", "Escape"]) == []
+
+def test_either_side_of_a_modifier_matches_a_chord():
+    matcher = detection.KeywordMatcher(["Win+R", "Ctrl+Alt+Del"])
+    assert feed(matcher, ["Rwin", "R"]) == ["Win+R"]
+    assert feed(matcher, ["Rcontrol", "Lmenu", "Delete"]) == ["Ctrl+Alt+Del"]
+
+def test_shift_and_caps_lock_do_not_break_a_keyword():
+    matcher = detection.KeywordMatcher(["POWERSHELL"])
+    assert feed(matcher, ["Capital", "P", "O", "W", "Lshift", "E", "R", "S", "H", "E", "L", "L"]) == ["POWERSHELL"]
+
+def test_overlapping_keywords_use_failure_links():
+    matcher = detection.KeywordMatcher(["USER", "SERVICE"])
+    assert feed(matcher, list("USERVICE")) == ["USER", "SERVICE"]
+    matcher = detection.KeywordMatcher(["TASK"])
+    assert feed(matcher, list("TTASTASK")) == ["TASK"]
+
+def test_step_is_stateless_across_channels():
+    matcher = detection.KeywordMatcher(["CMD"])
+    token = matcher.key_tokens.token
+    first = second = 0
+    first, _ = matcher.step(first, token("C"))
+    second, _ = matcher.step(second, token("X"))
+    first, _ = matcher.step(first, token("M"))
+    first, word = matcher.step(first, token("D"))
+    assert word == "CMD"
+    assert second == 0
+    assert matcher.state == 0
+
+def test_reset_forgets_a_partial_match():
+    matcher = detection.KeywordMatcher(["CMD"])
+    feed(matcher, ["C", "M"])
+    matcher.reset()
+    assert feed(matcher, ["D"]) == []
+
+def test_replayed_bare_f10_is_not_detected_as_shift_f10():
+    from replay import replay
+    handler, _ = replay([("F10", 0), ("Tab", 500)], ["Shift+F10", "Shift+Tab"], 30, 10, 'mean')
+    assert handler.detections == []
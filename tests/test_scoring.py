@@ -0,0 +1,105 @@
+import random
+
+import pytest
+
+import detection
+from replay import KeyEvent, ReplayConfig, ReplayIntrusionHandler, ReplayMonitor
+
+LETTERS = "ETAOINSHRDLU"
+
+def human_trace(seed, keys=400, median=180):
+    # Lognormal delays around `median` ms with the odd pause, 60-130 ms key holds and about 3% corrections
+    rng = random.Random(seed)
+    now = 0
+    events = []
+    for _ in range(keys):
+        key = 'Back' if rng.random() < 0.03 else rng.choice(LETTERS)
+        events.append((key, now, True))
+        events.append((key, now + rng.randint(60, 130), False))
+        delay = rng.lognormvariate(0, 0.45) * median
+        if rng.random() < 0.05:
+            delay += rng.randint(500, 2000)
+        now += int(delay)
+    return sorted(events, key=lambda event: event[1])
+
+def injected_trace(seed, keys=200, low=50, high=100, dwell=True):
+    # paygen.py's randint(50, 100) jitter; injected keys are released within a few ms, or never seen going up
+    rng = random.Random(seed)
+    now = 0
+    events = []
+    for _ in range(keys):
+        key = rng.choice(LETTERS)
+        events.append((key, now, True))
+        if dwell:
+            events.append((key, now + rng.randint(3, 8), False))
+        now += rng.randint(low, high)
+    return sorted(events, key=lambda event: event[1])
+
+def stream(events, limit=30, size=10):
+    # Key presses until the first block, or None, through the monitor's hook handlers
+    handler = ReplayIntrusionHandler()
+    monitor = ReplayMonitor(["zzqqzz"], handler, ReplayConfig(limit, size, 'mean', detector='dynamics'))
+    presses = 0
+    for key, time, down in events:
+        if not down:
+            monitor.KeyUpEvent(KeyEvent(key, time))
+            continue
+        presses += 1
+        monitor.KeyboardEvent(KeyEvent(key, time))
+        if handler.detections:
+            return presses
+    return None
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("median", [120, 180])
+def test_human_typing_is_never_flagged(seed, median):
+    assert stream(human_trace(seed, median=median)) is None
+
+@pytest.mark.parametrize("seed", range(5))
+def test_paygen_payload_is_flagged_at_the_first_full_window(seed):
+    assert stream(injected_trace(seed)) == detection.DynamicsDetector.MIN_KEYS + 1
+
+@pytest.mark.parametrize("seed", range(5))
+def test_regular_payload_at_human_speed_is_flagged(seed):
+    assert stream(injected_trace(seed, low=125, high=175, dwell=False)) <= 12
+
+def test_signals_are_zero_for_human_values_and_one_for_injected_ones():
+    engine = detection.ScoringEngine(30)
+    human = detection.KeystrokeFeatures(10)
+    keys = ['A', 'B', 'C', 'Back', 'D', 'E', 'F', 'G', 'H', 'I']
+    for key, delay in zip(keys, [150, 310, 90, 220, 480, 130, 260, 170, 400, 120]):
+        human.key_down(key, 0)
+        human.key_up(key, 90)
+        human.add(key, delay)
+    assert engine.signals(human)['speed'] == 0.0
+    assert engine.signals(human)['corrections'] == 0.0
+    assert engine.signals(human)['dwell'] == 0.0
+    assert engine.score(human) < engine.THRESHOLD
+    injected = detection.KeystrokeFeatures(10)
+    for key in "ABCDEFGHIJ":
+        injected.key_down(key, 0)
+        injected.key_up(key, 2)
+        injected.add(key, 25)
+    assert engine.signals(injected) == {'speed': 1.0, 'regularity': 1.0, 'entropy': 1.0, 'corrections': 1.0, 'dwell': 1.0}
+    assert engine.score(injected) == 1.0
+
+def test_threshold_sweep_matches_the_streaming_detector():
+    pytest.importorskip("numpy")
+    import batchscore
+    thresholds = [0.5, detection.ScoringEngine.THRESHOLD, 0.7]
+    for events in (human_trace(1, median=90), injected_trace(1), injected_trace(2, low=80, high=160)):
+        scores = batchscore.dynamics_scores(events, 30, 10)
+        result = batchscore.threshold_sweep(scores, thresholds)
+        detector = detection.DynamicsDetector(30, 10)
+        prev = -1
+        verdicts = []
+        for key, time, down in events:
+            if not down:
+                detector.key_up(key, time)
+                continue
+            detector.key_down(key, time)
+            verdicts.append(prev != -1 and detector.add(key, time - prev))
+            prev = time
+        first = verdicts.index(True) if True in verdicts else -1
+        assert result['first'][1] == first
+        assert result['flagged'][1] == sum(verdicts)
@@ -0,0 +1,57 @@
+import random
+import statistics
+
+import pytest
+
+import detection
+
+def reference(delays, limit, size, mode):
+    # The statistic recomputed from scratch over the window, the way the monitor used to do it
+    window = [limit + 1] * size + list(delays)
+    if mode == 'median':
+        return statistics.median(window[-size:])
+    if mode == 'ewma':
+        alpha = 2.0 / (size + 1)
+        value = float(limit + 1)
+        for delay in delays:
+            value += alpha * (delay - value)
+        return value
+    return sum(window[-size:]) / float(size)
+
+@pytest.mark.parametrize("mode", detection.SpeedHistory.MODES)
+@pytest.mark.parametrize("size", [1, 2, 5, 10])
+def test_matches_the_statistic_recomputed_from_scratch(mode, size):
+    rng = random.Random(size)
+    history = detection.SpeedHistory(30, size, mode)
+    delays = []
+    for _ in range(50):
+        delays.append(rng.randint(0, 400))
+        assert history.add(delays[-1]) == pytest.approx(reference(delays, 30, size, mode))
+
+def test_unknown_mode_falls_back_to_mean():
+    assert detection.SpeedHistory(30, 5, 'mode').mode == 'mean'
+
+def test_window_starts_above_the_limit():
+    history = detection.SpeedHistory(30, 4)
+    assert history.add(31) == 31.0
+    assert history.add(0) == pytest.approx(31 * 3 / 4.0)
+
+@pytest.mark.parametrize("mode", ['mean', 'median'])
+@pytest.mark.parametrize("new_size", [3, 6, 12])
+def test_resize_keeps_the_most_recent_delays(mode, new_size):
+    history = detection.SpeedHistory(30, 6, mode)
+    delays = [10, 20, 30, 40, 50, 60, 70, 80]
+    for delay in delays:
+        history.add(delay)
+    history.resize(new_size)
+    assert len(history) == new_size
+    kept = delays[-min(6, new_size):]  # Growing pads with the fill value, as a new window would
+    assert history.add(90) == pytest.approx(reference(kept + [90], 30, new_size, mode))
+
+def test_resize_twice_then_add_overwrites_the_oldest():
+    history = detection.SpeedHistory(30, 3)
+    for delay in (100, 200, 300):
+        history.add(delay)
+    history.resize(5)
+    history.resize(2)
+    assert history.add(400) == 350.0
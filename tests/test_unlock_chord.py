@@ -0,0 +1,49 @@
+import detection
+from replay import KeyEvent, ReplayConfig, ReplayIntrusionHandler, ReplayMonitor
+
+def blocked_monitor(chord="Ctrl+Alt+U"):
+    handler = ReplayIntrusionHandler(blocked=True)
+    monitor = ReplayMonitor(["zzqqzz"], handler, ReplayConfig(30, 10, 'mean', unlock_chord=chord))
+    return monitor, handler
+
+def press(monitor, *keys, time=1000):
+    return [monitor.KeyboardEvent(KeyEvent(key, time + i)) for i, key in enumerate(keys)]
+
+def release(monitor, *keys, time=2000):
+    for i, key in enumerate(keys):
+        monitor.KeyUpEvent(KeyEvent(key, time + i))
+
+def test_chord_keys_normalizes_sides_and_rejects_unknown_keys():
+    assert detection.chord_keys("Ctrl+Alt+Shift+U") == {"Control", "Menu", "Shift", "U"}
+    assert detection.chord_keys("ctrl+f12") == {"Control", "F12"}
+    assert detection.chord_keys("Ctrl+Nosuchkey") == frozenset()
+    assert detection.chord_keys("") == frozenset()
+
+def test_full_chord_unblocks():
+    monitor, handler = blocked_monitor()
+    press(monitor, "Lcontrol", "Lmenu", "U")
+    assert not handler.blocked
+    assert handler.unblocks == 1
+
+def test_right_side_modifiers_count():
+    monitor, handler = blocked_monitor()
+    press(monitor, "Rmenu", "Rcontrol", "U")
+    assert not handler.blocked
+
+def test_keys_released_in_between_do_not_unblock():
+    monitor, handler = blocked_monitor()
+    for key in ("Lcontrol", "Lmenu", "U"):
+        press(monitor, key)
+        release(monitor, key)
+    assert handler.blocked
+    assert handler.unblocks == 0
+
+def test_chord_keys_are_swallowed_while_blocked():
+    monitor, handler = blocked_monitor()
+    assert press(monitor, "Lcontrol", "A") == [False, False]
+    assert handler.blocked
+
+def test_no_chord_configured_never_unblocks():
+    monitor, handler = blocked_monitor(chord="")
+    press(monitor, "Lcontrol", "Lmenu", "U")
+    assert handler.blocked
@@ -0,0 +1,110 @@
+import queue
+import threading
+import types
+
+import pytest
+
+from safeusb import JournaledDeviceStore, SafeDeviceRegistry, USBEnumerator
+
+KEYBOARD = {'ID_MODEL_FROM_DATABASE': "USB Keyboard", 'ID_USB_CLASS_FROM_DATABASE': "HIDClass",
+            'DEVNAME': "USB\\VID_046D&PID_C31C\\1"}
+BADUSB = {'ID_MODEL_FROM_DATABASE': "USB Keyboard", 'ID_USB_CLASS_FROM_DATABASE': "HIDClass",
+          'DEVNAME': "USB\\VID_1B4F&PID_9208\\2"}
+KEYBOARD_IDENTITY = ("USB Keyboard", "HIDClass", "USB\\VID_046D&PID_C31C\\1")
+
+class StaticMonitor:
+    # The attached devices at startup; hot-plug events are submitted by the tests
+    def __init__(self, devices):
+        self.devices = devices
+
+    def get_available_devices(self):
+        return {key: dict(device) for key, device in self.devices.items()}
+
+    def start_monitoring(self, on_connect, on_disconnect):
+        pass
+
+class RunningWorker:
+    def is_alive(self):
+        return True
+
+class RecordingEnumerator(USBEnumerator):
+    # Control messages are collected instead of going to a spawned monitor
+    def start_monitor_worker(self):
+        self.control_queue = queue.Queue()
+        self.device_trust = None
+        self.keystroke_monitoring_process = RunningWorker()
+
+    def controls(self):
+        messages = []
+        while not self.control_queue.empty():
+            messages.append(self.control_queue.get())
+        return messages
+
+@pytest.fixture
+def registry(tmp_path):
+    registry = SafeDeviceRegistry(JournaledDeviceStore(str(tmp_path / "safedatabase.txt")))
+    registry.add(*KEYBOARD_IDENTITY)
+    return registry
+
+def enumerator(registry, devices):
+    return RecordingEnumerator(queue.Queue(), types.SimpleNamespace(attribution=None), None, registry,
+                          debounce_ms=10, max_latency_ms=50, usb_monitor=StaticMonitor(devices))
+
+def test_unregistering_an_attached_keyboard_arms_the_monitor(registry):
+    usb = enumerator(registry, {'kbd': KEYBOARD})
+    assert usb.devices['kbd']['Status'] == 'Safe'
+    assert not usb.keystroke_monitoring_started
+    registry.remove(*KEYBOARD_IDENTITY)  # As App.unregister_selected_devices does, on the GUI thread
+    assert usb.hotplug_scheduler.wait_idle(5)
+    assert usb.devices['kbd']['Status'] == 'Unregistered'
+    assert usb.unregistered_devices == {'kbd'}
+    assert usb.keystroke_monitoring_started
+    assert usb.controls() == [('arm',)]
+
+def test_registering_the_last_unregistered_keyboard_disarms(registry):
+    usb = enumerator(registry, {'kbd': KEYBOARD, 'bad': BADUSB})
+    assert usb.keystroke_monitoring_started
+    usb.controls()
+    registry.add("USB Keyboard", "HIDClass", BADUSB['DEVNAME'])
+    assert usb.hotplug_scheduler.wait_idle(5)
+    assert usb.devices['bad']['Status'] == 'Safe'
+    assert not usb.keystroke_monitoring_started
+    assert usb.controls() == [('unblock',), ('disarm',)]
+
+def test_unregistering_a_keyboard_that_was_just_unplugged(registry):
+    usb = enumerator(registry, {'kbd': KEYBOARD})
+    usb.hotplug_scheduler.submit('kbd', 'disconnect', KEYBOARD)
+    registry.remove(*KEYBOARD_IDENTITY)
+    assert usb.hotplug_scheduler.wait_idle(5)
+    assert usb.devices == {}
+    assert not usb.keystroke_monitoring_started
+
+def test_registry_changes_racing_hotplug_keep_the_monitor_armed_for_unregistered_devices(registry):
+    usb = enumerator(registry, {'kbd': KEYBOARD})
+
+    def plug():
+        for i in range(200):
+            usb.hotplug_scheduler.submit('bad', 'connect' if i % 2 == 0 else 'disconnect', dict(BADUSB))
+
+    plugger = threading.Thread(target=plug)
+    plugger.start()
+    for _ in range(50):
+        registry.remove(*KEYBOARD_IDENTITY)
+        registry.add(*KEYBOARD_IDENTITY)
+    registry.remove(*KEYBOARD_IDENTITY)
+    plugger.join()
+    assert usb.hotplug_scheduler.wait_idle(5)
+    assert usb.unregistered_devices == {'kbd'}
+    assert usb.keystroke_monitoring_started
+
+class StoppedWorker:
+    def is_alive(self):
+        return False
+
+def test_calibrate_reports_whether_the_worker_got_it(registry):
+    usb = enumerator(registry, {'kbd': KEYBOARD})
+    assert usb.calibrate('start', 'mean')
+    assert usb.controls() == [('calibrate', 'start', 'mean')]
+    usb.keystroke_monitoring_process = StoppedWorker()
+    assert not usb.calibrate('report')
+    assert usb.controls() == []
@@ -0,0 +1,62 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TESTS = os.path.dirname(os.path.abspath(__file__))
+
+SPAWN_BUDGET_MS = 1500  # Process start to target running, interpreter start-up included
+HOOK_IMPORT_BUDGET_MS = 500
+GUI_MODULES = ("gui", "tkinter", "PIL", "pystray", "win11toast", "usbmonitor", "winreg", "numpy")
+
+# Parent for a real spawn: __main__ claims to be safeusb.py, so the child re-runs it as __mp_main__ exactly as the
+# monitor worker does when SafeUSB starts it
+LAUNCHER = """
+import json, sys, time, multiprocessing
+import __main__
+__main__.__file__ = sys.argv[1]
+from worker_probe import probe
+ctx = multiprocessing.get_context("spawn")
+queue = ctx.Queue()
+start = time.time()
+process = ctx.Process(target=probe, args=(queue,))
+process.start()
+modules, ready = queue.get(timeout=60)
+process.join()
+print(json.dumps({"modules": modules, "spawn_ms": (ready - start) * 1000}))
+"""
+
+def spawn_worker():
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join((ROOT, TESTS)))
+    result = subprocess.run([sys.executable, "-c", LAUNCHER, os.path.join(ROOT, "safeusb.py")],
+                            cwd=ROOT, env=env, capture_output=True, text=True, timeout=120, check=True)
+    return json.loads(result.stdout.splitlines()[-1])
+
+def test_worker_reimports_safeusb_without_gui_libraries():
+    report = spawn_worker()
+    assert "__mp_main__" in report["modules"]
+    assert "detection" in report["modules"]
+    loaded = [name for name in report["modules"] if name.split(".")[0] in GUI_MODULES]
+    assert loaded == []
+
+def test_worker_spawn_is_within_budget():
+    spawn_ms = min(spawn_worker()["spawn_ms"] for _ in range(3))
+    assert spawn_ms < SPAWN_BUDGET_MS
+
+def test_hook_libraries_import_within_budget():
+    # The worker also imports pyWinhook and pythoncom before it can hook; only measurable on Windows
+    pytest.importorskip("pyWinhook")
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "import pyWinhook, pythoncom"], check=True)
+    baseline = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "pass"], check=True)
+    interpreter_ms = (time.perf_counter() - baseline) * 1000
+    assert (baseline - start) * 1000 - interpreter_ms < HOOK_IMPORT_BUDGET_MS
+
+def test_safeusb_imports_as_a_module():
+    import safeusb
+    assert safeusb.USBEnumerator and safeusb.ConfigHandler and safeusb.SafeDeviceRegistry
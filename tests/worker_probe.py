@@ -0,0 +1,6 @@
+import sys
+import time
+
+def probe(queue):
+    # Spawn target: reports what the worker has loaded by the time its target runs, and when that was
+    queue.put((sorted(sys.modules), time.time()))